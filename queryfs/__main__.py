@@ -0,0 +1,267 @@
+import argparse
+import logging
+import sys
+
+from pathlib import Path
+from typing import List, Optional
+from queryfs.blobs import DEFAULT_LAYOUT, MAX_LAYOUT, BlobStore
+from queryfs.db.session import Constraint, Session
+from queryfs.models.setting import Setting
+
+
+def migrate_blobs(arguments: argparse.Namespace) -> int:
+    repository = Path(arguments.repository)
+
+    session = Session(repository.joinpath("queryfs.db"))
+    session.create_table(Setting)
+
+    # record the new layout first, so new blobs of later mounts use it,
+    # blobs stay readable by running mounts during the migration
+    session.query(Setting).delete().where(
+        Constraint("name", "=", "blob_layout")
+    ).execute().close()
+
+    session.query(Setting).insert(
+        name="blob_layout", value=str(arguments.layout)
+    ).execute().close()
+
+    blob_store = BlobStore(
+        repository.joinpath("blobs"), layout=arguments.layout
+    )
+
+    moved = blob_store.migrate(arguments.batch_size, arguments.pause)
+
+    print(f"moved {moved} blobs to layout {arguments.layout}")
+
+    session.close()
+
+    return 0
+
+
+def require_fuse(command: str) -> bool:
+    # fusepy loads libfuse on import, the operations used by mount, remove
+    # and import build on it, migrate-blobs and export work without it
+    try:
+        import fuse  # noqa: F401
+    except (ImportError, OSError) as e:
+        print(f"{command} requires fusepy and libfuse: {e}", file=sys.stderr)
+
+        return False
+
+    return True
+
+
+def mount(arguments: argparse.Namespace) -> int:
+    if not require_fuse("mount"):
+        return 1
+
+    from fuse import FUSE
+    from queryfs.passthrough import Passthrough
+
+    operations = Passthrough(
+        arguments.repository,
+        commit_workers=arguments.commit_workers,
+        group_commit_window=arguments.group_commit_window,
+        mmap_reads=arguments.mmap_reads,
+    )
+
+    FUSE(
+        operations,
+        arguments.mountpoint,
+        foreground=arguments.foreground,
+        nothreads=arguments.single_threaded,
+        allow_other=arguments.allow_other,
+    )
+
+    return 0
+
+
+def remove(arguments: argparse.Namespace) -> int:
+    if not require_fuse("remove"):
+        return 1
+
+    from queryfs.passthrough import Passthrough
+
+    # commits inline, unreferenced blobs are reclaimed before exiting
+    operations = Passthrough(arguments.repository, commit_workers=0)
+
+    try:
+        operations.remove_tree(arguments.path)
+    finally:
+        operations.destroy("/")
+
+    return 0
+
+
+def import_tree(arguments: argparse.Namespace) -> int:
+    if not require_fuse("import"):
+        return 1
+
+    from queryfs.importer import Importer
+    from queryfs.passthrough import Passthrough
+
+    operations = Passthrough(arguments.repository, commit_workers=0)
+
+    try:
+        directories, files = Importer(
+            operations,
+            arguments.workers,
+            arguments.batch_size,
+            arguments.link,
+        ).run(arguments.source)
+    finally:
+        operations.destroy("/")
+
+    print(f"imported {directories} directories and {files} files")
+
+    return 0
+
+
+def export_tree(arguments: argparse.Namespace) -> int:
+    from queryfs.exporter import Exporter, open_blob_store
+
+    repository = Path(arguments.repository)
+    db_name = repository.joinpath("queryfs.db")
+
+    if not db_name.is_file():
+        print(f"no repository at '{repository}'", file=sys.stderr)
+
+        return 1
+
+    session = Session(db_name)
+
+    try:
+        directories, files = Exporter(
+            session,
+            open_blob_store(session, repository.joinpath("blobs")),
+            arguments.workers,
+            arguments.link,
+        ).run(arguments.path, arguments.destination)
+    finally:
+        session.close()
+
+    print(f"exported {directories} directories and {files} files")
+
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="queryfs")
+    parser.add_argument("--verbose", action="store_true")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-blobs",
+        help="move blobs into another directory layout, "
+        "also while the repository is mounted",
+    )
+    migrate_parser.add_argument("repository")
+    migrate_parser.add_argument(
+        "--layout",
+        type=int,
+        choices=range(MAX_LAYOUT + 1),
+        default=DEFAULT_LAYOUT,
+        help="number of two character directory levels",
+    )
+    migrate_parser.add_argument("--batch-size", type=int, default=1000)
+    migrate_parser.add_argument(
+        "--pause",
+        type=float,
+        default=0.0,
+        help="seconds to wait between batches",
+    )
+    migrate_parser.set_defaults(func=migrate_blobs)
+
+    mount_parser = subparsers.add_parser(
+        "mount", help="mount a repository, multithreaded by default"
+    )
+    mount_parser.add_argument("repository")
+    mount_parser.add_argument("mountpoint")
+    mount_parser.add_argument("--foreground", action="store_true")
+    mount_parser.add_argument(
+        "--single-threaded",
+        action="store_true",
+        help="handle one filesystem request at a time",
+    )
+    mount_parser.add_argument("--allow-other", action="store_true")
+    mount_parser.add_argument(
+        "--commit-workers",
+        type=int,
+        default=4,
+        help="threads committing released files, 0 commits on release",
+    )
+    mount_parser.add_argument(
+        "--group-commit-window",
+        type=float,
+        default=0.0,
+        help="seconds to batch metadata writes, 0 disables group commit",
+    )
+    mount_parser.add_argument("--mmap-reads", action="store_true")
+    mount_parser.set_defaults(func=mount)
+
+    remove_parser = subparsers.add_parser(
+        "remove",
+        help="remove a file or a directory with all its entries "
+        "from a repository that is not mounted, requires fusepy",
+    )
+    remove_parser.add_argument("repository")
+    remove_parser.add_argument("path")
+    remove_parser.set_defaults(func=remove)
+
+    import_parser = subparsers.add_parser(
+        "import",
+        help="import a directory tree into a repository that is not "
+        "mounted, existing files are skipped, requires fusepy",
+    )
+    import_parser.add_argument("source")
+    import_parser.add_argument("repository")
+    import_parser.add_argument(
+        "--workers", type=int, help="threads hashing and storing files"
+    )
+    import_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="files recorded per transaction",
+    )
+    import_parser.add_argument(
+        "--link",
+        action="store_true",
+        help="hardlink source files into the repository instead of "
+        "copying them, the source files must not be changed afterwards",
+    )
+    import_parser.set_defaults(func=import_tree)
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="copy a file or directory tree out of a repository, "
+        "sharing data with the blobs where the file system allows it",
+    )
+    export_parser.add_argument("repository")
+    export_parser.add_argument("path")
+    export_parser.add_argument("destination")
+    export_parser.add_argument(
+        "--workers", type=int, help="threads materializing files"
+    )
+    export_parser.add_argument(
+        "--link",
+        action="store_true",
+        help="hardlink blobs instead of cloning them where their mode and "
+        "modification time match the files, exported files must not be "
+        "changed afterwards",
+    )
+    export_parser.set_defaults(func=export_tree)
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    status: int = arguments.func(arguments)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import os
+import stat
+
+from typing import Any, Dict, Optional
+from queryfs.models.file import File
+from queryfs.models.directory import Directory
+
+# attributes reported for all entries, st_birthtime only exists on some
+# platforms and is added for files from the database
+STAT_KEYS = [
+    "st_atime",
+    "st_ctime",
+    "st_gid",
+    "st_mode",
+    "st_mtime",
+    "st_nlink",
+    "st_size",
+    "st_uid",
+]
+
+FILE_MODE = stat.S_IFREG | 0o644
+DIRECTORY_MODE = stat.S_IFDIR | 0o755
+
+
+def stat_attributes(st: os.stat_result) -> Dict[str, Any]:
+    return {key: getattr(st, key) for key in STAT_KEYS}
+
+
+def value_or_default(value: Any, default: Any) -> Any:
+    # rows created before a field existed store null
+    return default if value is None else value
+
+
+def file_attributes(
+    file_instance: File, defaults: Dict[str, Any]
+) -> Dict[str, Any]:
+    return {
+        **defaults,
+        "st_mode": value_or_default(file_instance.mode, FILE_MODE),
+        "st_uid": value_or_default(file_instance.uid, defaults["st_uid"]),
+        "st_gid": value_or_default(file_instance.gid, defaults["st_gid"]),
+        "st_nlink": value_or_default(file_instance.nlink, 1),
+        "st_atime": file_instance.atime,
+        "st_birthtime": file_instance.ctime,
+        "st_ctime": file_instance.ctime,
+        "st_mtime": file_instance.mtime,
+        "st_size": file_instance.size,
+    }
+
+
+def directory_attributes(
+    directory_instance: Optional[Directory], defaults: Dict[str, Any]
+) -> Dict[str, Any]:
+    attributes = {
+        **defaults,
+        "st_mode": DIRECTORY_MODE,
+        "st_nlink": 2,
+        "st_size": 0,
+    }
+
+    if directory_instance is None:
+        return attributes
+
+    for key in ["mode", "uid", "gid", "nlink", "atime", "ctime", "mtime"]:
+        attributes[f"st_{key}"] = value_or_default(
+            getattr(directory_instance, key), attributes[f"st_{key}"]
+        )
+
+    return attributes
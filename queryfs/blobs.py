@@ -0,0 +1,476 @@
+from __future__ import annotations
+
+import errno
+import mmap
+import os
+import threading
+import time
+import uuid
+
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from queryfs import PathLike
+from queryfs.compression import (
+    DEFAULT_FRAME_SIZE,
+    Codec,
+    FrameIndex,
+    iter_frames,
+    write_frames,
+)
+
+
+# blob layouts are the number of directory levels of two hex characters,
+# 0 stores blobs flat, 2 stores them as blobs/ab/cd/<hash>
+DEFAULT_LAYOUT = 2
+MAX_LAYOUT = 3
+
+
+class BlobReader:
+    def read(self, size: int, offset: int) -> bytes:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        ...
+
+
+class FileReader(BlobReader):
+    def __init__(self, fd: int) -> None:
+        self.fd = fd
+
+    def read(self, size: int, offset: int) -> bytes:
+        return os.pread(self.fd, size, offset)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class MappedReader(BlobReader):
+    def __init__(
+        self, store: BlobStore, hash: str, mapping: mmap.mmap
+    ) -> None:
+        self.store = store
+        self.hash = hash
+        self.mapping = mapping
+
+    def read(self, size: int, offset: int) -> bytes:
+        return self.mapping[offset : offset + size]
+
+    def close(self) -> None:
+        self.store.unmap(self.hash)
+
+
+class FramedReader(BlobReader):
+    def __init__(self, fd: int, cached_frames: int = 4) -> None:
+        self.fd = fd
+
+        try:
+            self.index = FrameIndex(fd)
+        except BaseException:
+            os.close(fd)
+
+            raise
+
+        # recently decompressed frames, sequential reads are usually
+        # smaller than a frame
+        self.frames: OrderedDict[int, bytes] = OrderedDict()
+        self.cached_frames = cached_frames
+        self.frames_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.index.size
+
+    def get_frame(self, position: int) -> bytes:
+        with self.frames_lock:
+            if position in self.frames:
+                self.frames.move_to_end(position)
+
+                return self.frames[position]
+
+        start = self.index.offsets[position]
+        end = self.index.offsets[position + 1]
+
+        # decompress outside the lock, concurrent reads of other frames
+        # through the same handle proceed in parallel
+        frame = os.pread(self.fd, end - start, start)
+
+        if not self.index.entries[position][1]:
+            frame = self.index.codec.decompress(frame)
+
+        with self.frames_lock:
+            self.frames[position] = frame
+
+            while len(self.frames) > self.cached_frames:
+                self.frames.popitem(last=False)
+
+        return frame
+
+    def read(self, size: int, offset: int) -> bytes:
+        frame_size = self.index.frame_size
+        end = min(offset + size, self.index.size)
+        buffers: List[bytes] = []
+
+        while offset < end:
+            position, frame_offset = divmod(offset, frame_size)
+            frame = self.get_frame(position)
+            length = min(end - offset, len(frame) - frame_offset)
+
+            if length <= 0:
+                break
+
+            buffers.append(frame[frame_offset : frame_offset + length])
+
+            offset += length
+
+        return b"".join(buffers)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+        self.frames.clear()
+
+
+class ChunkedReader(BlobReader):
+    def __init__(
+        self,
+        store: BlobStore,
+        chunks: List[Tuple[int, int, str]],
+        max_readers: int = 8,
+    ) -> None:
+        # chunks as (offset, size, hash) ordered by offset
+        self.store = store
+        self.chunks = chunks
+        self.offsets = [x[0] for x in chunks]
+
+        # readers of recently read chunks, least recently used first,
+        # large files are read sequentially and would otherwise keep a
+        # descriptor open for every chunk
+        self.max_readers = max(max_readers, 1)
+
+        self.readers: OrderedDict[str, BlobReader] = OrderedDict()
+        self.readers_lock = threading.Lock()
+
+        # readers that are being read, evicted readers are closed once
+        # their last read completes
+        self.reading: Dict[int, int] = {}
+        self.evicted: Set[int] = set()
+
+    def acquire_reader(self, hash: str) -> BlobReader:
+        evicted: List[BlobReader] = []
+
+        with self.readers_lock:
+            reader = self.readers.get(hash)
+
+            if reader is None:
+                reader = self.store.open_reader(hash)
+
+                self.readers[hash] = reader
+
+                while len(self.readers) > self.max_readers:
+                    _, oldest = self.readers.popitem(last=False)
+
+                    if self.reading.get(id(oldest)):
+                        self.evicted.add(id(oldest))
+                    else:
+                        evicted.append(oldest)
+            else:
+                self.readers.move_to_end(hash)
+
+            self.reading[id(reader)] = self.reading.get(id(reader), 0) + 1
+
+        for x in evicted:
+            x.close()
+
+        return reader
+
+    def release_reader(self, reader: BlobReader) -> None:
+        with self.readers_lock:
+            self.reading[id(reader)] -= 1
+
+            if self.reading[id(reader)]:
+                return
+
+            del self.reading[id(reader)]
+
+            if id(reader) not in self.evicted:
+                return
+
+            self.evicted.remove(id(reader))
+
+        reader.close()
+
+    def read(self, size: int, offset: int) -> bytes:
+        buffers: List[bytes] = []
+        index = bisect_right(self.offsets, offset) - 1
+
+        while size > 0 and 0 <= index < len(self.chunks):
+            chunk_offset, chunk_size, chunk_hash = self.chunks[index]
+            chunk_position = offset - chunk_offset
+            length = min(size, chunk_size - chunk_position)
+
+            if length > 0:
+                reader = self.acquire_reader(chunk_hash)
+
+                try:
+                    buffers.append(reader.read(length, chunk_position))
+                finally:
+                    self.release_reader(reader)
+
+                offset += length
+                size -= length
+
+            index += 1
+
+        return b"".join(buffers)
+
+    def close(self) -> None:
+        with self.readers_lock:
+            readers = list(self.readers.values())
+
+            self.readers = OrderedDict()
+
+        for reader in readers:
+            reader.close()
+
+
+class BlobStore:
+    def __init__(
+        self,
+        root: PathLike,
+        codec: Optional[Codec] = None,
+        frame_size: int = DEFAULT_FRAME_SIZE,
+        layout: int = DEFAULT_LAYOUT,
+    ) -> None:
+        if not 0 <= layout <= MAX_LAYOUT:
+            raise ValueError(f"Unsupported blob layout '{layout}'")
+
+        self.root = Path(root)
+
+        # blobs are written with this layout and looked up in the others,
+        # which keeps them readable while a migration is moving them
+        self.layout = layout
+        self.layouts = [layout] + [
+            x for x in range(MAX_LAYOUT + 1) if x != layout
+        ]
+
+        # shard directories known to exist
+        self.directories: Set[Path] = set()
+
+        # compress blobs in independently compressed frames
+        self.codec = codec
+        self.frame_size = frame_size
+
+        # memory maps of blob files shared by all handles of the same hash
+        self.mappings: Dict[str, mmap.mmap] = {}
+        self.mapping_references: Dict[str, int] = {}
+        self.mappings_lock = threading.Lock()
+
+    def layout_path(self, hash: str, layout: int) -> Path:
+        parts = [hash[x * 2 : x * 2 + 2] for x in range(layout)]
+
+        return self.root.joinpath(*parts, hash)
+
+    def path(self, hash: str) -> Path:
+        return self.layout_path(hash, self.layout)
+
+    def locate(self, hash: str) -> Optional[Path]:
+        for layout in self.layouts:
+            blob_path = self.layout_path(hash, layout)
+
+            if blob_path.is_file():
+                return blob_path
+
+        return None
+
+    def exists(self, hash: str) -> bool:
+        return self.locate(hash) is not None
+
+    def open_fd(self, hash: str) -> int:
+        # retry once if a migration moved the blob in between
+        for _ in range(2):
+            blob_path = self.locate(hash)
+
+            if blob_path is None:
+                break
+
+            try:
+                return os.open(blob_path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), hash)
+
+    def create_directory(self, blob_path: Path) -> None:
+        directory = blob_path.parent
+
+        # racing creations of the same directory are harmless
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+
+            self.directories.add(directory)
+
+    def remove(self, hash: str) -> None:
+        for layout in self.layouts:
+            blob_path = self.layout_path(hash, layout)
+
+            if blob_path.is_file():
+                os.unlink(blob_path)
+
+    def write_frames(self, hash: str, frames: Iterator[bytes]) -> None:
+        blob_path = self.path(hash)
+
+        self.create_directory(blob_path)
+
+        # write next to the blob and rename so readers never see
+        # partially written blobs
+        temp_path = blob_path.with_name(f".{hash}.{uuid.uuid4().hex}")
+
+        try:
+            with open(temp_path, "wb") as f:
+                if self.codec is None:
+                    for frame in frames:
+                        f.write(frame)
+                else:
+                    write_frames(frames, f, self.codec, self.frame_size)
+
+            os.rename(temp_path, blob_path)
+        except BaseException:
+            if temp_path.exists():
+                os.unlink(temp_path)
+
+            raise
+
+    def write(self, hash: str, data: bytes) -> None:
+        frame_size = self.frame_size
+
+        self.write_frames(
+            hash,
+            (
+                data[x : x + frame_size]
+                for x in range(0, len(data), frame_size)
+            ),
+        )
+
+    def put(self, hash: str, path: PathLike, link: bool = True) -> None:
+        if self.codec is None and link:
+            blob_path = self.path(hash)
+
+            self.create_directory(blob_path)
+
+            # blobs are immutable, share the inode with the staged file
+            try:
+                os.link(path, blob_path)
+            except FileExistsError:
+                return
+            except OSError as e:
+                # files on other file systems are copied instead
+                if e.errno != errno.EXDEV:
+                    raise
+            else:
+                return
+
+        with open(path, "rb") as f:
+            self.write_frames(hash, iter_frames(f, self.frame_size))
+
+    def open_reader(self, hash: str, mapped: bool = False) -> BlobReader:
+        if self.codec is not None:
+            return FramedReader(self.open_fd(hash))
+
+        if mapped:
+            mapping = self.map(hash)
+
+            if mapping is not None:
+                return MappedReader(self, hash, mapping)
+
+        return FileReader(self.open_fd(hash))
+
+    def map(self, hash: str) -> Optional[mmap.mmap]:
+        with self.mappings_lock:
+            if hash not in self.mappings:
+                fd = self.open_fd(hash)
+
+                try:
+                    # empty files can not be mapped
+                    if not os.fstat(fd).st_size:
+                        return None
+
+                    self.mappings[hash] = mmap.mmap(
+                        fd, 0, access=mmap.ACCESS_READ
+                    )
+                    self.mapping_references[hash] = 0
+                finally:
+                    os.close(fd)
+
+            self.mapping_references[hash] += 1
+
+            return self.mappings[hash]
+
+    def unmap(self, hash: str) -> None:
+        with self.mappings_lock:
+            if hash not in self.mappings:
+                return
+
+            self.mapping_references[hash] -= 1
+
+            if self.mapping_references[hash] <= 0:
+                self.mappings.pop(hash).close()
+
+                del self.mapping_references[hash]
+
+    def iter_blobs(self) -> Iterator[Tuple[str, Path, int]]:
+        for directory, _, file_names in os.walk(self.root):
+            parts = Path(directory).relative_to(self.root).parts
+
+            for file_name in file_names:
+                # skip blobs that are still being written
+                if file_name.startswith("."):
+                    continue
+
+                layout = len(parts)
+
+                if self.layout_path(file_name, layout) != Path(
+                    directory, file_name
+                ):
+                    continue
+
+                yield file_name, Path(directory, file_name), layout
+
+    def migrate(self, batch_size: int = 1000, pause: float = 0.0) -> int:
+        # move blobs of other layouts into this layout in batches,
+        # each blob is linked to its new path before the old path is
+        # removed, so it can always be located
+        moved = 0
+
+        for hash, blob_path, layout in self.iter_blobs():
+            if layout == self.layout:
+                continue
+
+            target_path = self.path(hash)
+
+            self.create_directory(target_path)
+
+            try:
+                os.link(blob_path, target_path)
+            except FileExistsError:
+                pass
+
+            os.unlink(blob_path)
+
+            moved += 1
+
+            if pause and not moved % batch_size:
+                time.sleep(pause)
+
+        return moved
+
+    def close(self) -> None:
+        with self.mappings_lock:
+            mappings: List[mmap.mmap] = list(self.mappings.values())
+
+            self.mappings = {}
+            self.mapping_references = {}
+
+        for mapping in mappings:
+            mapping.close()
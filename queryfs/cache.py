@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import threading
+
+from collections import OrderedDict
+from typing import Any, Generic, Optional, TypeVar, cast
+
+T = TypeVar("T")
+
+# sentinel for paths that are not cached at all,
+# None is a valid cached value for paths that do not exist
+MISSING: Any = object()
+
+
+class DentryCache(Generic[T]):
+    def __init__(self, size: int = 4096) -> None:
+        self.size = size
+
+        self.entries: OrderedDict[str, Optional[T]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        # bumped on every invalidation, values looked up before an
+        # invalidation may be stale and are not cached
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+
+        if not lookups:
+            return 0.0
+
+        return self.hits / lookups
+
+    def get(self, key: str) -> Optional[T]:
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+
+                self.entries.move_to_end(key)
+
+                return self.entries[key]
+
+            self.misses += 1
+
+        return cast(Optional[T], MISSING)
+
+    def put(
+        self, key: str, value: Optional[T], generation: Optional[int] = None
+    ) -> None:
+        if self.size <= 0:
+            return
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.entries[key] = value
+
+            self.entries.move_to_end(key)
+
+            # evict least recently used entries
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self.lock:
+            self.generation += 1
+
+            self.entries.pop(key, None)
+
+    def invalidate_tree(self, key: str) -> None:
+        prefix = f"{key}/"
+
+        with self.lock:
+            keys = [
+                x
+                for x in self.entries.keys()
+                if x == key or x.startswith(prefix)
+            ]
+
+            self.generation += 1
+
+            for x in keys:
+                del self.entries[x]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+
+            self.entries.clear()
@@ -0,0 +1,190 @@
+import hashlib
+
+from bisect import bisect_left
+from typing import Any, BinaryIO, Iterator, List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # type: ignore
+
+# random values for every byte, derived from sha256 so that chunk
+# boundaries are stable across processes and versions
+GEAR: List[int] = [
+    int.from_bytes(hashlib.sha256(bytes([x])).digest()[:8], "big")
+    for x in range(256)
+]
+
+GEAR_MODULO = (1 << 64) - 1
+
+# the gear hash shifts every byte out after this many bytes
+GEAR_WINDOW = 64
+
+# bytes scanned for boundaries at once
+SCAN_SIZE = 1 << 16
+
+
+def cut(
+    data: bytes,
+    start: int,
+    minimum_size: int,
+    maximum_size: int,
+    mask: int,
+    window_end: Optional[int] = None,
+) -> int:
+    # length of the chunk starting at start, the hash is tested up to
+    # window_end only if given
+    length = len(data) - start
+
+    if length <= minimum_size:
+        return length
+
+    end = start + min(length, maximum_size)
+    gear = GEAR
+    hash = 0
+
+    for index in range(start + minimum_size, min(end, window_end or end)):
+        hash = ((hash << 1) + gear[data[index]]) & GEAR_MODULO
+
+        if not hash & mask:
+            return index + 1 - start
+
+    return end - start
+
+
+def find_boundaries(data: bytes, mask: int) -> List[int]:
+    # indexes of all bytes where the gear hash of the window ending there
+    # is a boundary, computed by doubling the window in a few vectorised
+    # passes that release the gil, segments are sized to stay in cache
+    assert numpy is not None
+
+    gear = numpy.array(GEAR, dtype=numpy.uint64)
+    view = numpy.frombuffer(data, dtype=numpy.uint8)
+    shifted = numpy.empty(SCAN_SIZE + GEAR_WINDOW, dtype=numpy.uint64)
+    boundaries: List[int] = []
+
+    for start in range(0, len(view), SCAN_SIZE):
+        # windows of the first bytes reach into the previous segment
+        low = max(start - GEAR_WINDOW + 1, 0)
+        hashes: Any = gear[view[low : start + SCAN_SIZE]]
+        width = 1
+
+        while width < GEAR_WINDOW:
+            count = max(len(hashes) - width, 0)
+
+            numpy.left_shift(
+                hashes[:count], numpy.uint64(width), out=shifted[:count]
+            )
+
+            hashes[width:] += shifted[:count]
+            width *= 2
+
+        indexes = numpy.flatnonzero(hashes & numpy.uint64(mask) == 0) + low
+        boundaries += indexes[indexes >= start].tolist()
+
+    return boundaries
+
+
+class Chunker:
+    def __init__(
+        self,
+        average_size: int,
+        minimum_size: Optional[int] = None,
+        maximum_size: Optional[int] = None,
+    ) -> None:
+        if minimum_size is None:
+            minimum_size = average_size // 4
+
+        if maximum_size is None:
+            maximum_size = average_size * 4
+
+        self.average_size = average_size
+        self.minimum_size = minimum_size
+        self.maximum_size = maximum_size
+
+        # the gear hash mixes older bytes into the high bits,
+        # test those for a boundary
+        bits = max(average_size.bit_length() - 1, 1)
+
+        self.mask = ((1 << bits) - 1) << (64 - bits)
+
+        # once a whole window is hashed, the hash only depends on the last
+        # bytes, boundaries of a buffer are then found at once regardless
+        # of where its chunks start
+        self.vectorised = numpy is not None
+
+    def cut(self, data: bytes) -> int:
+        return cut(data, 0, self.minimum_size, self.maximum_size, self.mask)
+
+    def cut_all(self, data: bytes, final: bool) -> List[int]:
+        # lengths of the chunks of a buffer, a trailing chunk shorter than
+        # the maximum size is only cut at the end of the file
+        lengths: List[int] = []
+        boundaries: List[int] = []
+        start = 0
+
+        if self.vectorised:
+            boundaries = find_boundaries(data, self.mask)
+
+        while start < len(data) and (
+            final or len(data) - start >= self.maximum_size
+        ):
+            if not self.vectorised:
+                length = cut(
+                    data,
+                    start,
+                    self.minimum_size,
+                    self.maximum_size,
+                    self.mask,
+                )
+            else:
+                # hashing starts at the minimum size, bytes before a whole
+                # window is hashed are tested one by one
+                window = start + self.minimum_size + GEAR_WINDOW - 1
+                limit = min(len(data) - start, self.maximum_size)
+
+                length = cut(
+                    data,
+                    start,
+                    self.minimum_size,
+                    self.maximum_size,
+                    self.mask,
+                    window,
+                )
+
+                if length == limit and start + limit > window:
+                    index = bisect_left(boundaries, window)
+
+                    if index < len(boundaries):
+                        length = min(limit, boundaries[index] + 1 - start)
+
+            lengths.append(length)
+            start += length
+
+        return lengths
+
+    def chunks(self, f: BinaryIO) -> Iterator[bytes]:
+        buffer = b""
+        block_size = max(self.maximum_size * 4, 1 << 22)
+
+        while True:
+            block = f.read(block_size)
+
+            buffer += block
+
+            # only cut once a full maximum sized chunk is buffered
+            # or the end of the file is reached
+            if len(buffer) < self.maximum_size and block:
+                continue
+
+            start = 0
+
+            for length in self.cut_all(buffer, not block):
+                yield buffer[start : start + length]
+
+                start += length
+
+            buffer = buffer[start:]
+
+            if not block:
+                break
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import errno
+import os
+import threading
+
+from typing import Callable, Optional, Set
+from queryfs.blobs import BlobReader
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# ioctl sharing the extents of another file, supported by btrfs, xfs and
+# other copy-on-write file systems on linux
+FICLONE = 0x40049409
+
+# errors of file systems or kernels that do not support a copy method
+UNSUPPORTED = set(
+    [
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        errno.ENOTSUP,
+        errno.EXDEV,
+    ]
+)
+
+
+def reflink(source_fd: int, target_fd: int) -> bool:
+    if fcntl is None:
+        return False
+
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+    except OSError as e:
+        if e.errno not in UNSUPPORTED:
+            raise
+
+        return False
+
+    return True
+
+
+def copy_range(source_fd: int, target_fd: int, size: int) -> bool:
+    # copies within the kernel, file systems may share or offload extents
+    copy_file_range: Optional[Callable[..., int]] = getattr(
+        os, "copy_file_range", None
+    )
+
+    if copy_file_range is None:
+        return False
+
+    offset = 0
+
+    while offset < size:
+        try:
+            copied = copy_file_range(
+                source_fd, target_fd, size - offset, offset, offset
+            )
+        except OSError as e:
+            # fall back unless some data has been copied already
+            if e.errno not in UNSUPPORTED or offset:
+                raise
+
+            return False
+
+        if not copied:
+            break
+
+        offset += copied
+
+    return True
+
+
+def copy_buffered(
+    read: Callable[[int, int], bytes],
+    target_fd: int,
+    size: int,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+) -> None:
+    # read takes size and offset like BlobReader.read
+    offset = 0
+
+    while offset < size:
+        data = read(min(buffer_size, size - offset), offset)
+
+        if not data:
+            break
+
+        offset += os.pwrite(target_fd, data, offset)
+
+
+def clone(source_fd: int, target_fd: int, size: int) -> str:
+    # clone a whole file with the cheapest method available, returns the
+    # name of the method
+    if reflink(source_fd, target_fd):
+        return "reflink"
+
+    if copy_range(source_fd, target_fd, size):
+        return "copy_file_range"
+
+    copy_buffered(lambda x, y: os.pread(source_fd, x, y), target_fd, size)
+
+    return "buffered"
+
+
+class CopyUp:
+    def __init__(
+        self,
+        reader: BlobReader,
+        fd: int,
+        size: int,
+        block_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> None:
+        # copies blocks of a blob into a sparse file of the same size when
+        # they are first read or written
+        self.reader = reader
+        self.fd = fd
+        self.block_size = block_size
+
+        # bytes of the blob that still belong to the file
+        self.size = size
+
+        self.copied: Set[int] = set()
+        self.lock = threading.Lock()
+
+    def fill(self, offset: int, length: int) -> None:
+        end = min(offset + length, self.size)
+
+        if offset >= end:
+            return
+
+        with self.lock:
+            first = offset // self.block_size
+            last = (end - 1) // self.block_size
+
+            for block in range(first, last + 1):
+                if block in self.copied:
+                    continue
+
+                start = block * self.block_size
+                data = self.reader.read(
+                    min(self.block_size, self.size - start), start
+                )
+
+                os.pwrite(self.fd, data, start)
+
+                self.copied.add(block)
+
+    def truncate(self, length: int) -> None:
+        # keep the data before the new end, bytes past it read as zeros
+        # when the file is extended again
+        if length:
+            self.fill(length - 1, 1)
+
+        with self.lock:
+            self.size = min(self.size, length)
+
+    def complete(self) -> None:
+        self.fill(0, self.size)
+
+    def close(self) -> None:
+        self.reader.close()
+
+        os.close(self.fd)
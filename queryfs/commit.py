@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List
+from queryfs.handles import FileHandle
+
+logger = logging.getLogger("commit")
+
+
+class CommitError(Exception):
+    ...
+
+
+class CommitPipeline:
+    def __init__(
+        self, commit: Callable[[FileHandle], None], workers: int = 4
+    ) -> None:
+        self.commit = commit
+
+        # one single threaded executor per worker, commits of the same
+        # path always run on the same worker and in order
+        self.executors: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(1, thread_name_prefix=f"commit-{x}")
+            for x in range(workers)
+        ]
+
+        self.pending: Dict[str, List[Future[None]]] = {}
+        self.pending_lock = threading.Lock()
+
+        # handles of failed commits by temp file, the temp files are kept
+        # until a later commit of them succeeds
+        self.failed: Dict[Path, FileHandle] = {}
+
+    def submit(self, handle: FileHandle) -> Future[None]:
+        # without executors the commit is registered as pending and run
+        # by the caller through run_inline, once it released its locks
+        key = handle.path
+
+        with self.pending_lock:
+            if self.executors:
+                executor = self.executors[hash(key) % len(self.executors)]
+                future = executor.submit(self.run, handle)
+            else:
+                future = Future()
+
+            self.pending.setdefault(key, []).append(future)
+
+        future.add_done_callback(lambda x: self.remove_pending(key, x))
+
+        return future
+
+    def run_inline(self, handle: FileHandle, future: Future[None]) -> None:
+        if self.executors:
+            return
+
+        try:
+            self.commit(handle)
+        except BaseException as e:
+            future.set_exception(e)
+
+            raise
+
+        future.set_result(None)
+
+    def run(self, handle: FileHandle) -> None:
+        try:
+            self.commit(handle)
+        except Exception:
+            logger.exception(f"commit failed for '{handle.path}'")
+
+            with self.pending_lock:
+                self.failed[handle.backing_path] = handle
+
+            return
+
+        with self.pending_lock:
+            self.failed.pop(handle.backing_path, None)
+
+    def remove_pending(self, key: str, future: Future[None]) -> None:
+        with self.pending_lock:
+            futures = self.pending.get(key, [])
+
+            if future in futures:
+                futures.remove(future)
+
+            if not futures:
+                self.pending.pop(key, None)
+
+    def is_pending(self, key: str, tree: bool = False) -> bool:
+        prefix = f"{key}/"
+
+        with self.pending_lock:
+            if key in self.pending:
+                return True
+
+            return tree and any(x.startswith(prefix) for x in self.pending)
+
+    def wait(
+        self, key: str, tree: bool = False, children: bool = False
+    ) -> None:
+        # wait for pending commits of a path, of the entries of a directory
+        # or of a whole directory tree
+        prefix = f"{key}/"
+
+        with self.pending_lock:
+            futures = [
+                future
+                for pending_key, pending_futures in self.pending.items()
+                if pending_key == key
+                or (tree and (not key or pending_key.startswith(prefix)))
+                or (children and pending_key.rpartition("/")[0] == key)
+                for future in pending_futures
+            ]
+
+        wait(futures)
+
+    def drain(self) -> None:
+        self.wait("", tree=True)
+
+        with self.pending_lock:
+            failed = list(self.failed.values())
+
+            self.failed = {}
+
+        if not failed:
+            return
+
+        # failed commits are retried once, in order of their paths
+        for handle in failed:
+            self.run_inline(handle, self.submit(handle))
+
+        self.wait("", tree=True)
+
+        with self.pending_lock:
+            paths = sorted([x.path for x in self.failed.values()])
+
+        if paths:
+            raise CommitError(f"commits failed for {', '.join(paths)}")
+
+    def close(self) -> None:
+        try:
+            self.drain()
+        except CommitError:
+            # the temp files of failed commits are kept
+            logger.exception("unable to commit all released files")
+
+        for executor in self.executors:
+            executor.shutdown()
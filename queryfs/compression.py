@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import lzma
+import os
+import struct
+import zlib
+
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple
+
+MAGIC = b"QFSF"
+
+# magic, version, frame size, codec name length
+HEADER = struct.Struct(">4sBQB")
+
+# frame offset, frame stored uncompressed
+INDEX_ENTRY = struct.Struct(">Q?")
+
+# index offset, frame count, uncompressed size, magic
+FOOTER = struct.Struct(">QQQ4s")
+
+DEFAULT_FRAME_SIZE = 1 << 20
+
+
+class CompressionError(Exception):
+    ...
+
+
+class Codec:
+    def __init__(
+        self,
+        name: str,
+        compress: Callable[[bytes], bytes],
+        decompress: Callable[[bytes], bytes],
+    ) -> None:
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+codecs: Dict[str, Codec] = {}
+
+
+def register_codec(
+    name: str,
+    compress: Callable[[bytes], bytes],
+    decompress: Callable[[bytes], bytes],
+) -> Codec:
+    codec = Codec(name, compress, decompress)
+
+    codecs[name] = codec
+
+    return codec
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return codecs[name]
+    except KeyError:
+        raise CompressionError(f"Unknown compression codec '{name}'")
+
+
+register_codec("zlib", zlib.compress, zlib.decompress)
+register_codec("lzma", lzma.compress, lzma.decompress)
+
+
+def iter_frames(f: BinaryIO, frame_size: int) -> Iterator[bytes]:
+    for frame in iter(lambda: f.read(frame_size), b""):
+        yield frame
+
+
+def write_frames(
+    frames: Iterator[bytes], f: BinaryIO, codec: Codec, frame_size: int
+) -> None:
+    codec_name = codec.name.encode()
+
+    f.write(HEADER.pack(MAGIC, 1, frame_size, len(codec_name)))
+    f.write(codec_name)
+
+    index: List[Tuple[int, bool]] = []
+    offset = HEADER.size + len(codec_name)
+    size = 0
+
+    for frame in frames:
+        compressed = codec.compress(frame)
+
+        # keep incompressible frames as they are
+        stored = len(compressed) >= len(frame)
+
+        if stored:
+            compressed = frame
+
+        f.write(compressed)
+
+        index.append((offset, stored))
+
+        offset += len(compressed)
+        size += len(frame)
+
+    for entry in index:
+        f.write(INDEX_ENTRY.pack(*entry))
+
+    f.write(FOOTER.pack(offset, len(index), size, MAGIC))
+
+
+class FrameIndex:
+    def __init__(self, fd: int) -> None:
+        file_size = os.fstat(fd).st_size
+
+        self.frame_size: int
+        self.size: int
+
+        if file_size < HEADER.size + FOOTER.size:
+            raise CompressionError("Blob is not a compressed frame file")
+
+        header = os.pread(fd, HEADER.size, 0)
+        magic, _, self.frame_size, codec_name_length = HEADER.unpack(header)
+
+        if magic != MAGIC:
+            raise CompressionError("Blob is not a compressed frame file")
+
+        self.codec = get_codec(
+            os.pread(fd, codec_name_length, HEADER.size).decode()
+        )
+
+        footer = os.pread(fd, FOOTER.size, file_size - FOOTER.size)
+        index_offset, frame_count, self.size, magic = FOOTER.unpack(footer)
+
+        # blobs cut short lose their footer
+        index_size = INDEX_ENTRY.size * frame_count
+
+        if magic != MAGIC or index_offset + index_size > file_size:
+            raise CompressionError("Compressed frame file is truncated")
+
+        index = os.pread(fd, index_size, index_offset)
+
+        self.entries: List[Tuple[int, bool]] = [
+            INDEX_ENTRY.unpack_from(index, x * INDEX_ENTRY.size)
+            for x in range(frame_count)
+        ]
+
+        # the index directly follows the last frame
+        self.offsets = [x[0] for x in self.entries] + [index_offset]
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+)
+from queryfs import PathLike
+from queryfs.db.schema import Schema
+from queryfs.db.session import Constraint, QueryBuilder, Session
+
+T = TypeVar("T", bound="Schema")
+R = TypeVar("R")
+
+
+class AsyncQueryBuilder(Generic[T]):
+    def __init__(
+        self,
+        session: AsyncSession,
+        schema: Type[T],
+        executor: ThreadPoolExecutor,
+    ) -> None:
+        self.session = session
+        self.schema = schema
+
+        # statements are built synchronously, the cursor is only ever
+        # used on the worker thread that owns its connection
+        self.builder: QueryBuilder[T] = session.session.query(schema)
+        self.executor = executor
+
+    def run(self, func: Callable[[], R]) -> Awaitable[R]:
+        return self.session.submit(func, self.executor)
+
+    def select(self, *args: str) -> AsyncQueryBuilder[T]:
+        self.builder.select(*args)
+
+        return self
+
+    def delete(self) -> AsyncQueryBuilder[T]:
+        self.builder.delete()
+
+        return self
+
+    def insert(self, **kwargs: Any) -> AsyncQueryBuilder[T]:
+        self.builder.insert(**kwargs)
+
+        return self
+
+    def update(self, **kwargs: Any) -> AsyncQueryBuilder[T]:
+        self.builder.update(**kwargs)
+
+        return self
+
+    def insert_many(
+        self, rows: Iterable[Dict[str, Any]]
+    ) -> AsyncQueryBuilder[T]:
+        self.builder.insert_many(rows)
+
+        return self
+
+    def update_many(
+        self, rows: Iterable[Dict[str, Any]], key: str = "id"
+    ) -> AsyncQueryBuilder[T]:
+        self.builder.update_many(rows, key)
+
+        return self
+
+    def where(self, *args: Constraint) -> AsyncQueryBuilder[T]:
+        self.builder.where(*args)
+
+        return self
+
+    async def execute(self) -> AsyncQueryBuilder[T]:
+        await self.run(self.builder.execute)
+
+        return self
+
+    async def get_last_row_id(self) -> Optional[int]:
+        return await self.run(self.builder.get_last_row_id)
+
+    async def get_row_ids(self) -> List[int]:
+        return await self.run(self.builder.get_row_ids)
+
+    async def close(self) -> AsyncQueryBuilder[T]:
+        await self.run(self.builder.close)
+
+        return self
+
+    async def fetch_one(self) -> Optional[T]:
+        return await self.run(self.builder.fetch_one)
+
+    async def fetch_all(self) -> List[T]:
+        return await self.run(self.builder.fetch_all)
+
+    async def fetch_iter(self, size: int = 256) -> AsyncIterator[T]:
+        # one worker round trip per batch of rows
+        cursor = self.builder.cursor
+
+        if cursor is None:
+            return
+
+        try:
+            while True:
+                rows: List[T] = await self.run(
+                    lambda: cursor.fetchmany(size)
+                )
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield row
+        finally:
+            await self.close()
+
+
+class AsyncSession:
+    def __init__(
+        self,
+        db_name: PathLike,
+        pragmas: Optional[Dict[str, Any]] = None,
+        cached_statements: int = 256,
+        workers: int = 4,
+        queue_size: int = 1024,
+    ) -> None:
+        self.session = Session(db_name, pragmas, cached_statements)
+
+        # one single threaded executor per worker, each keeps its own
+        # connection and runs all statements of a query in order
+        self.executors: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(1, thread_name_prefix=f"db-{x}")
+            for x in range(max(workers, 1))
+        ]
+        self.next_executor = itertools.cycle(self.executors)
+
+        # bounds the work waiting for a worker, callers beyond the bound
+        # wait on the event loop instead of queueing up more work
+        self.queue_size = queue_size
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # created on first use, within the running event loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.queue_size)
+
+        return self.semaphore
+
+    async def submit(
+        self, func: Callable[[], R], executor: ThreadPoolExecutor
+    ) -> R:
+        async with self.get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, func
+            )
+
+    async def run(self, func: Callable[[Session], R]) -> R:
+        # run synchronous session work on a worker, e.g. several queries
+        # within one session.transaction()
+        return await self.submit(
+            lambda: func(self.session), next(self.next_executor)
+        )
+
+    def query(self, schema: Type[T]) -> AsyncQueryBuilder[T]:
+        return AsyncQueryBuilder(self, schema, next(self.next_executor))
+
+    async def table_exists(self, schema: Type[T]) -> bool:
+        return await self.run(lambda x: x.table_exists(schema))
+
+    async def create_table(self, schema: Type[T]) -> None:
+        await self.run(lambda x: x.create_table(schema))
+
+    async def close(self) -> None:
+        # finish queued work before the connections are closed
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
+        self.session.close()
+
+    def shutdown(self) -> None:
+        for executor in self.executors:
+            executor.shutdown()
+
+    async def __aenter__(self) -> AsyncSession:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
@@ -7,7 +7,17 @@ import logging
 from contextlib import closing
 from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Iterable, List, Any, Optional, Type, TypeVar, Union
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Any,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 from queryfs import PathLike
 
 T = TypeVar("T", bound="Schema")
@@ -15,32 +25,110 @@ T = TypeVar("T", bound="Schema")
 logger = logging.getLogger("db")
 
 
-class Schema:
+class Index:
+    def __init__(
+        self, *fields: str, unique: bool = False, where: Optional[str] = None
+    ) -> None:
+        self.fields = fields
+        self.unique = unique
+
+        # partial indexes only cover rows matching the condition
+        self.where = where
+
+    def get_name(self, table_name: str) -> str:
+        suffix = "unique" if self.unique else "index"
+
+        if self.where:
+            suffix = f"partial_{suffix}"
+
+        return "_".join([table_name, *self.fields, suffix])
+
+
+def get_field_default(value: str) -> Any:
+    value = value.lower()
+
+    if "null" in value:
+        return None
+
+    if value.startswith("text"):
+        return ""
+
+    if value.startswith("integer"):
+        return 0
+
+    if value.startswith("real"):
+        return 0.0
+
+    return None
+
+
+class SchemaMeta(type):
+    def __new__(
+        mcs, name: str, bases: Tuple[type, ...], namespace: Dict[str, Any]
+    ) -> SchemaMeta:
+        fields: Optional[OrderedDict[str, str]] = namespace.get("fields")
+
+        if fields is None:
+            namespace.setdefault("__slots__", ())
+
+            return super().__new__(mcs, name, bases, namespace)
+
+        # field values live in slots, class level defaults of the same
+        # name would shadow them
+        for key in fields:
+            namespace.pop(key, None)
+
+        # the layout of the fields is computed once per class
+        namespace["__slots__"] = tuple(fields)
+        namespace["field_names"] = tuple(fields)
+        namespace["field_defaults"] = tuple(
+            [get_field_default(x) for x in fields.values()]
+        )
+
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Schema(metaclass=SchemaMeta):
     # db specific attributes
     table_name: str = ""
     fields: OrderedDict[str, str] = OrderedDict()
+    indexes: List[Index] = []
+
+    # precomputed by the metaclass
+    field_names: Tuple[str, ...] = ()
+    field_defaults: Tuple[Any, ...] = ()
 
     # object methods
 
     def __init__(self, *args: Any) -> None:
-        for key, value in self.fields.items():
-            if value.lower().startswith("text"):
-                setattr(self, key, "")
-            elif value.lower().startswith("integer"):
-                setattr(self, key, 0)
-            elif value.lower().startswith("real"):
-                setattr(self, key, 0.0)
-
-            if "null" in value.lower():
-                setattr(self, key, None)
+        for key, value in zip(self.field_names, self.field_defaults):
+            setattr(self, key, value)
 
         self.hydrate(*args)
 
-    def __repr__(self) -> str:
-        fields = list(self.fields.keys())
+    @classmethod
+    def from_row(
+        cls: Type[T], names: Tuple[str, ...], row: Tuple[Any, ...]
+    ) -> T:
+        # rows of any selection of fields, in the order they were selected
+        instance = cls.__new__(cls)
+
+        for key, value in zip(cls.field_names, cls.field_defaults):
+            setattr(instance, key, value)
 
+        for key, value in zip(names, row):
+            if value is not None:
+                setattr(instance, key, value)
+
+        return instance
+
+    def __repr__(self) -> str:
         info = " ".join(
-            [f"{x}='{getattr(self, x)}'" for x in fields if hasattr(self, x)]
+            [
+                f"{x}='{getattr(self, x)}'"
+                for x in self.field_names
+                if hasattr(self, x)
+            ]
         )
 
         return f"<{self.__class__.__name__} {info} at {hex(id(self))}>"
@@ -48,6 +136,6 @@ class Schema:
     # data hydration
 
     def hydrate(self, *args: Any) -> None:
-        for index, arg in enumerate(args):
-            if index < len(self.fields.keys()) and arg is not None:
-                setattr(self, list(self.fields.keys())[index], arg)
\ No newline at end of file
+        for key, arg in zip(self.field_names, args):
+            if arg is not None:
+                setattr(self, key, arg)
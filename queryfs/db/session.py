@@ -3,17 +3,45 @@ from __future__ import annotations
 import sqlite3
 import logging
 import os
-
-from functools import reduce
-from contextlib import closing
+import queue
+import threading
+import time
+import weakref
+
+from functools import lru_cache
+from concurrent.futures import Future
+from contextlib import closing, contextmanager
 from collections import OrderedDict
-from typing import Generic, List, Any, Optional, Tuple, Type, TypeVar, Dict
+from typing import (
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Any,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Dict,
+)
 from queryfs import PathLike
-from queryfs.db.schema import Schema
+from queryfs.db.schema import Index, Schema
 
 T = TypeVar("T", bound="Schema")
 logger = logging.getLogger("db")
 
+# pragmas applied to every connection opened by a session
+DEFAULT_PRAGMAS: OrderedDict[str, Any] = OrderedDict(
+    {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "temp_store": "memory",
+    }
+)
+
 
 class NotFoundException(Exception):
     ...
@@ -23,6 +51,14 @@ class QueryBuilderError(Exception):
     ...
 
 
+class TransactionError(Exception):
+    ...
+
+
+# shape of a statement, operation and field names without any values
+Shape = Tuple[Any, ...]
+
+
 class Statement:
     TYPE_KEYWORD: int = 1
     TYPE_FILTER: int = 10
@@ -30,14 +66,14 @@ class Statement:
     def __init__(
         self,
         statement_type: int,
-        statement: str,
+        shape: Shape,
         values: Optional[List[Any]] = None,
     ) -> None:
         if values is None:
             values = []
 
         self.statement_type = statement_type
-        self.statement = statement
+        self.shape = shape
         self.values = values
 
 
@@ -48,6 +84,76 @@ class Constraint:
         self.value = value
 
 
+def compile_keyword(table_name: str, shape: Shape) -> str:
+    operation, fields = shape
+
+    if operation == "select":
+        return f"SELECT {', '.join(fields)} FROM {table_name}"
+
+    if operation == "delete":
+        return f"DELETE FROM {table_name}"
+
+    values = ", ".join(["?" for _ in fields])
+
+    if operation == "insert":
+        return (
+            f"INSERT INTO {table_name} ({', '.join(fields)}) VALUES ({values})"
+        )
+
+    return f"UPDATE {table_name} SET ({', '.join(fields)}) = ({values})"
+
+
+def compile_filter(shape: Shape) -> str:
+    constraint_strings: List[str] = []
+
+    for constraint_type, fields in shape:
+        fields_string: str = ", ".join(fields)
+        values_string: str = ", ".join(["?" for _ in fields])
+
+        constraint_strings.append(
+            f"({fields_string}) {constraint_type} ({values_string})"
+        )
+
+    return " ".join(["WHERE", " AND ".join(constraint_strings)])
+
+
+@lru_cache(maxsize=1024)
+def select_shape(schema: Type[Schema], args: Tuple[str, ...]) -> Shape:
+    fields: Tuple[str, ...] = tuple(schema.fields)
+
+    if args:
+        fields = tuple([field for field in args if field in fields])
+
+    return ("select", fields)
+
+
+@lru_cache(maxsize=1024)
+def get_row_factory(
+    schema: Type[T], names: Tuple[str, ...]
+) -> Callable[[sqlite3.Cursor, Tuple[Any, ...]], T]:
+    # build models straight from the cursor
+    if names == schema.field_names:
+        return lambda cursor, row: schema(*row)
+
+    return lambda cursor, row: schema.from_row(names, row)
+
+
+@lru_cache(maxsize=1024)
+def compile_query(
+    table_name: str, keyword: Optional[Shape], filter: Optional[Shape]
+) -> str:
+    # queries are compiled once per shape, executions only bind values
+    statements: List[str] = []
+
+    if keyword is not None:
+        statements.append(compile_keyword(table_name, keyword))
+
+    if filter is not None:
+        statements.append(compile_filter(filter))
+
+    return " ".join(statements)
+
+
 class QueryBuilder(Generic[T]):
     def __init__(
         self,
@@ -59,6 +165,13 @@ class QueryBuilder(Generic[T]):
 
         self.query: List[Statement] = []
         self.cursor: Optional[sqlite3.Cursor] = None
+        self.row_factory: Optional[
+            Callable[[sqlite3.Cursor, Tuple[Any, ...]], T]
+        ] = None
+
+        # values of bulk statements, one list per row
+        self.rows: Optional[List[List[Any]]] = None
+        self.row_ids: List[int] = []
 
     def get_last_row_id(self) -> Optional[int]:
         if self.cursor:
@@ -68,55 +181,64 @@ class QueryBuilder(Generic[T]):
 
             return last_row_id
 
+    def get_row_count(self) -> int:
+        if self.cursor:
+            row_count = self.cursor.rowcount
+
+            self.close()
+
+            return row_count
+
+        return 0
+
+    def get_row_ids(self) -> List[int]:
+        row_ids = self.row_ids
+
+        self.row_ids = []
+        self.close()
+
+        return row_ids
+
+    def check_fields(
+        self, rows: List[Dict[str, Any]], fields: Tuple[str, ...]
+    ) -> None:
+        # all rows of a bulk statement share the fields of the first row
+        names = set(fields)
+
+        for row in rows:
+            if row.keys() != names:
+                raise QueryBuilderError(
+                    f"Bulk row fields {sorted(row)} differ from "
+                    f"{sorted(names)}"
+                )
+
+    def get_row_values(
+        self, row: Dict[str, Any], fields: Tuple[str, ...]
+    ) -> List[Any]:
+        try:
+            return [row[x] for x in fields]
+        except KeyError as e:
+            raise QueryBuilderError(f"Missing field {e} in bulk row")
+
     def select(self, *args: str) -> QueryBuilder[T]:
-        fields = list(self.schema.fields.keys())
+        shape = select_shape(self.schema, args)
 
-        if args:
-            fields = [field for field in args if field in fields]
+        self.query.append(Statement(Statement.TYPE_KEYWORD, shape))
 
-        self.query.append(
-            Statement(
-                Statement.TYPE_KEYWORD,
-                " ".join(
-                    [
-                        "SELECT",
-                        ", ".join(fields),
-                        "FROM",
-                        self.schema.table_name,
-                    ]
-                ),
-            )
-        )
+        self.row_factory = get_row_factory(self.schema, shape[1])
 
         return self
 
     def delete(self) -> QueryBuilder[T]:
-        self.query.append(
-            Statement(
-                Statement.TYPE_KEYWORD,
-                " ".join(
-                    [
-                        f"DELETE FROM {self.schema.table_name}",
-                    ]
-                ),
-            )
-        )
+        self.query.append(Statement(Statement.TYPE_KEYWORD, ("delete", ())))
 
         return self
 
     def insert(self, **kwargs: Any) -> QueryBuilder[T]:
-        fields: str = ", ".join([x for x in kwargs.keys()])
-        values: str = ", ".join(["?" for _ in kwargs.keys()])
-
         self.query.append(
             Statement(
                 Statement.TYPE_KEYWORD,
-                " ".join(
-                    [
-                        f"INSERT INTO {self.schema.table_name}",
-                        f"({fields}) VALUES ({values})",
-                    ]
-                ),
+                ("insert", tuple(kwargs)),
                 list(kwargs.values()),
             )
         )
@@ -124,100 +246,177 @@ class QueryBuilder(Generic[T]):
         return self
 
     def update(self, **kwargs: Any) -> QueryBuilder[T]:
-        fields: str = ", ".join([x for x in kwargs.keys()])
-        values: str = ", ".join(["?" for _ in kwargs.keys()])
-
         self.query.append(
             Statement(
                 Statement.TYPE_KEYWORD,
-                " ".join(
-                    [
-                        f"UPDATE {self.schema.table_name}",
-                        f"SET ({fields}) = ({values})",
-                    ]
-                ),
+                ("update", tuple(kwargs)),
                 list(kwargs.values()),
             )
         )
 
         return self
 
-    def where(self, *args: Constraint) -> QueryBuilder[T]:
-        # fields: str = ", ".join([x for x in kwargs.keys()])
-        # values: str = ", ".join(["?" for _ in kwargs.keys()])
+    def insert_many(self, rows: Iterable[Dict[str, Any]]) -> QueryBuilder[T]:
+        rows = list(rows)
+        fields: Tuple[str, ...] = tuple(rows[0]) if rows else ()
 
-        constraints_grouped: Dict[str, List[Constraint]] = {}
+        # ids of inserted rows are derived from the last row id, which
+        # requires the database to assign consecutive ids
+        if "id" in fields:
+            raise QueryBuilderError("Bulk rows must not contain field 'id'")
 
-        for constraint in args:
-            group = constraints_grouped.setdefault(constraint.type, [])
+        self.check_fields(rows, fields)
+
+        self.query.append(
+            Statement(Statement.TYPE_KEYWORD, ("insert", fields))
+        )
 
-            group.append(constraint)
+        self.rows = [self.get_row_values(x, fields) for x in rows]
 
-        constraint_strings: List[str] = []
+        return self
 
-        values: List[Any] = []
+    def update_many(
+        self, rows: Iterable[Dict[str, Any]], key: str = "id"
+    ) -> QueryBuilder[T]:
+        # rows are matched by the key field, all other fields are updated
+        rows = list(rows)
+        fields: Tuple[str, ...] = ()
 
-        for constraint_type, constraints in constraints_grouped.items():
-            fields_string: str = ", ".join([x.field for x in constraints])
-            values_string: str = ", ".join(["?" for _ in constraints])
+        if rows:
+            fields = tuple([x for x in rows[0] if x != key])
 
-            constraint_strings.append(
-                f"({fields_string}) {constraint_type} ({values_string})"
-            )
-            values += [x.value for x in constraints]
+            if not fields:
+                raise QueryBuilderError("Bulk rows have no fields to update")
 
-        constraint_string = " AND ".join(constraint_strings)
+            self.check_fields(rows, fields + (key,))
 
         self.query.append(
-            Statement(
-                Statement.TYPE_FILTER,
-                " ".join(["WHERE", constraint_string]),
-                values,
-            )
+            Statement(Statement.TYPE_KEYWORD, ("update", fields))
         )
+        self.query.append(Statement(Statement.TYPE_FILTER, (("=", (key,)),)))
+
+        self.rows = [self.get_row_values(x, fields + (key,)) for x in rows]
 
         return self
 
-    def build(self) -> Tuple[str, List[Any]]:
-        def values_reducer(a: List[Any], b: Statement) -> List[Any]:
-            return a + b.values
+    def where(self, *args: Constraint) -> QueryBuilder[T]:
+        # constraints of the same type are compared as one row value
+        fields_grouped: Dict[str, List[str]] = {}
+        values_grouped: Dict[str, List[Any]] = {}
 
-        # filter statements
-        statements_filtered: List[Statement] = []
+        for constraint in args:
+            if constraint.type in fields_grouped:
+                fields_grouped[constraint.type].append(constraint.field)
+                values_grouped[constraint.type].append(constraint.value)
+            else:
+                fields_grouped[constraint.type] = [constraint.field]
+                values_grouped[constraint.type] = [constraint.value]
 
-        for statement in self.query:
-            statement_types = [x.statement_type for x in statements_filtered]
+        values: List[Any] = []
 
-            if statement.statement_type not in statement_types:
-                statements_filtered.append(statement)
-            else:
+        for group in values_grouped.values():
+            values += group
+
+        shape = tuple([(x, tuple(y)) for x, y in fields_grouped.items()])
+
+        self.query.append(Statement(Statement.TYPE_FILTER, shape, values))
+
+        return self
+
+    def build(self) -> Tuple[str, List[Any]]:
+        statements: Dict[int, Statement] = {}
+
+        for statement in self.query:
+            if statement.statement_type in statements:
                 raise QueryBuilderError(
                     f"Duplicate statement of type {statement.statement_type}"
                 )
 
-        statements_sorted = sorted(
-            statements_filtered, key=lambda x: x.statement_type
-        )
-        initial_values: List[Any] = []
+            statements[statement.statement_type] = statement
 
-        query_string = " ".join([x.statement for x in statements_sorted])
-        query_values = reduce(
-            values_reducer, statements_sorted, initial_values
+        keyword = statements.get(Statement.TYPE_KEYWORD)
+        filter = statements.get(Statement.TYPE_FILTER)
+
+        query_string = compile_query(
+            self.schema.table_name,
+            keyword.shape if keyword else None,
+            filter.shape if filter else None,
         )
 
+        query_values: List[Any] = []
+
+        if keyword:
+            query_values += keyword.values
+
+        if filter:
+            query_values += filter.values
+
         return (query_string, query_values)
 
     def execute(self) -> QueryBuilder[T]:
-        with self.session.connect() as connection:
-            cursor = connection.cursor()
-            query = self.build()
+        if self.rows is not None:
+            return self.execute_many()
 
-            logger.info(query)
+        connection = self.session.connect()
+        query = self.build()
 
-            # empty query
-            self.query = []
+        logger.info(query)
 
+        # empty query
+        self.query = []
+
+        cursor = connection.cursor()
+
+        if self.row_factory is not None:
+            cursor.row_factory = self.row_factory
+
+        if self.session.in_transaction():
+            # committed together with the surrounding transaction
             self.cursor = cursor.execute(*query)
+        else:
+            with connection:
+                self.cursor = cursor.execute(*query)
+
+        return self
+
+    def execute_many(self) -> QueryBuilder[T]:
+        rows = self.rows or []
+        is_insert = any(
+            x.statement_type == Statement.TYPE_KEYWORD
+            and x.shape[0] == "insert"
+            for x in self.query
+        )
+
+        self.rows = None
+        self.row_ids = []
+
+        if not rows:
+            self.query = []
+
+            return self
+
+        query_string, _ = self.build()
+
+        logger.info((query_string, f"{len(rows)} rows"))
+
+        # empty query
+        self.query = []
+
+        with self.session.transaction():
+            connection = self.session.connect()
+
+            self.cursor = connection.cursor().executemany(query_string, rows)
+
+            if is_insert:
+                # a single statement within a write transaction assigns
+                # consecutive ids
+                (last_row_id,) = connection.execute(
+                    "SELECT last_insert_rowid()"
+                ).fetchone()
+
+                self.row_ids = list(
+                    range(last_row_id - len(rows) + 1, last_row_id + 1)
+                )
 
         return self
 
@@ -231,33 +430,210 @@ class QueryBuilder(Generic[T]):
 
     def fetch_one(self) -> Optional[T]:
         if self.cursor:
-            result = self.cursor.fetchone()
+            result: Optional[T] = self.cursor.fetchone()
 
             self.close()
 
-            if result:
-                return self.schema(*result)
+            return result
 
     def fetch_all(self) -> List[T]:
         if self.cursor:
-            result = self.cursor.fetchall()
+            result: List[T] = self.cursor.fetchall()
 
             self.close()
 
-            return [self.schema(*x) for x in result]
+            return result
 
         return []
 
+    def fetch_iter(self, size: int = 256) -> Iterator[T]:
+        # stream rows in batches instead of materializing all of them
+        cursor = self.cursor
+
+        if cursor is None:
+            return
+
+        try:
+            while True:
+                rows: List[T] = cursor.fetchmany(size)
+
+                if not rows:
+                    break
+
+                yield from rows
+        finally:
+            self.close()
+
+
+class ConnectionOwner:
+    # held in thread local storage only, released with the locals of the
+    # thread when it exits
+    __slots__ = ("connection", "__weakref__")
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+
+def release_connection(
+    connections: Dict[int, sqlite3.Connection],
+    lock: threading.Lock,
+    key: int,
+) -> None:
+    # connections closed by the session are no longer registered
+    with lock:
+        connection = connections.pop(key, None)
+
+    if connection is not None:
+        connection.close()
+
 
 class Session:
-    def __init__(self, db_name: PathLike) -> None:
+    def __init__(
+        self,
+        db_name: PathLike,
+        pragmas: Optional[Dict[str, Any]] = None,
+        cached_statements: int = 256,
+    ) -> None:
         self.db_name = db_name
 
+        # prepared statements kept per connection, compiled queries are
+        # identical strings so they hit this cache
+        self.cached_statements = cached_statements
+
+        if pragmas is None:
+            pragmas = DEFAULT_PRAGMAS
+
+        self.pragmas: OrderedDict[str, Any] = OrderedDict(pragmas)
+
+        # keep one open connection per thread, closed when the thread
+        # exits so short lived threads do not leak connections
+        self.local = threading.local()
+        self.connections: Dict[int, sqlite3.Connection] = {}
+        self.connections_lock = threading.Lock()
+
     def query(self, schema: Type[T]) -> QueryBuilder[T]:
         return QueryBuilder(self, schema)
 
     def connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_name)
+        owner: Optional[ConnectionOwner] = getattr(self.local, "owner", None)
+
+        if owner is None:
+            # connections are only ever used by the thread that opened them,
+            # close() may still be called from another thread at unmount
+            connection = sqlite3.connect(
+                self.db_name,
+                check_same_thread=False,
+                cached_statements=self.cached_statements,
+            )
+
+            for key, value in self.pragmas.items():
+                pragma_query = f"PRAGMA {key} = {value}"
+
+                logger.info(pragma_query)
+
+                connection.execute(pragma_query).close()
+
+            owner = ConnectionOwner(connection)
+
+            with self.connections_lock:
+                self.connections[id(connection)] = connection
+
+            weakref.finalize(
+                owner,
+                release_connection,
+                self.connections,
+                self.connections_lock,
+                id(connection),
+            )
+
+            self.local.owner = owner
+
+        return owner.connection
+
+    def get_transaction_depth(self) -> int:
+        return getattr(self.local, "transaction_depth", 0)
+
+    def in_transaction(self) -> bool:
+        return self.get_transaction_depth() > 0
+
+    def begin(self) -> None:
+        connection = self.connect()
+        depth = self.get_transaction_depth()
+
+        if depth:
+            # nested transactions are savepoints of the outer transaction
+            connection.execute(f"SAVEPOINT transaction_{depth}").close()
+        else:
+            # take the write lock up front instead of failing to upgrade
+            # a read lock later on
+            connection.execute("BEGIN IMMEDIATE").close()
+
+        self.local.transaction_depth = depth + 1
+
+    def commit(self) -> None:
+        depth = self.get_transaction_depth()
+
+        if not depth:
+            raise TransactionError("No transaction in progress")
+
+        connection = self.connect()
+
+        self.local.transaction_depth = depth - 1
+
+        if depth > 1:
+            connection.execute(f"RELEASE transaction_{depth - 1}").close()
+
+            return
+
+        try:
+            connection.commit()
+        except sqlite3.Error:
+            connection.rollback()
+
+            raise
+
+    def rollback(self) -> None:
+        depth = self.get_transaction_depth()
+
+        if not depth:
+            raise TransactionError("No transaction in progress")
+
+        connection = self.connect()
+
+        self.local.transaction_depth = depth - 1
+
+        if depth > 1:
+            connection.execute(f"ROLLBACK TO transaction_{depth - 1}").close()
+            connection.execute(f"RELEASE transaction_{depth - 1}").close()
+
+            return
+
+        connection.rollback()
+
+    @contextmanager
+    def transaction(self) -> Iterator[Session]:
+        self.begin()
+
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+
+            raise
+
+        self.commit()
+
+    def close(self) -> None:
+        with self.connections_lock:
+            connections = list(self.connections.values())
+
+            self.connections.clear()
+
+        # drop thread local references to the closed connections
+        self.local = threading.local()
+
+        for connection in connections:
+            connection.close()
 
     def table_exists(self, schema: Type[T]) -> bool:
         with self.connect() as connection:
@@ -275,32 +651,207 @@ class Session:
         return False
 
     def create_table(self, schema: Type[T]) -> None:
-        if self.table_exists(schema):
-            return
+        if not self.table_exists(schema):
+            with self.connect() as connection:
+                with closing(connection.cursor()) as cursor:
+                    fields: List[str] = [
+                        f"{key} {value.upper()}"
+                        for key, value in schema.fields.items()
+                    ]
+
+                    # if schema.relations:
+                    #     for _, relation in schema.relations.items():
+                    #         fields.append(
+                    #             f"FOREIGN KEY ({relation.own_key}) REFERENCES {relation.schema.table_name}"
+                    #         )
+
+                    fields_string = ", ".join(fields)
+
+                    create_table_query: Tuple[str, List[Any]] = (
+                        f"CREATE TABLE {schema.table_name} ({fields_string})",
+                        [],
+                    )
+
+                    logger.info(create_table_query)
+
+                    cursor.execute(*create_table_query)
+        else:
+            # add fields introduced after the table was created,
+            # existing rows read them as null
+            columns = self.get_columns(schema)
+
+            for key, value in schema.fields.items():
+                if key not in columns:
+                    self.add_column(schema, key, value)
+
+        # indexes are created for existing tables as well
+        for index in schema.indexes:
+            self.create_index(schema, index)
+
+    def get_columns(self, schema: Type[T]) -> List[str]:
+        with closing(self.connect().cursor()) as cursor:
+            rows = cursor.execute(
+                f"PRAGMA table_info({schema.table_name})"
+            ).fetchall()
+
+        return [x[1] for x in rows]
+
+    def add_column(self, schema: Type[T], key: str, value: str) -> None:
+        add_column_query: Tuple[str, List[Any]] = (
+            " ".join(
+                [
+                    f"ALTER TABLE {schema.table_name}",
+                    f"ADD COLUMN {key} {value.upper()}",
+                ]
+            ),
+            [],
+        )
+
+        logger.info(add_column_query)
 
         with self.connect() as connection:
-            with closing(connection.cursor()) as cursor:
-                fields: List[str] = [
-                    f"{key} {value.upper()}"
-                    for key, value in schema.fields.items()
+            connection.execute(*add_column_query).close()
+
+    def create_index(self, schema: Type[T], index: Index) -> None:
+        fields_string = ", ".join(index.fields)
+        unique_string = "UNIQUE " if index.unique else ""
+        where_string = f"WHERE {index.where}" if index.where else ""
+
+        create_index_query: Tuple[str, List[Any]] = (
+            " ".join(
+                [
+                    f"CREATE {unique_string}INDEX IF NOT EXISTS",
+                    index.get_name(schema.table_name),
+                    f"ON {schema.table_name} ({fields_string})",
+                    where_string,
                 ]
+            ).strip(),
+            [],
+        )
 
-                # if schema.relations:
-                #     for _, relation in schema.relations.items():
-                #         fields.append(
-                #             f"FOREIGN KEY ({relation.own_key}) REFERENCES {relation.schema.table_name}"
-                #         )
+        logger.info(create_index_query)
 
-                fields_string = ", ".join(fields)
+        try:
+            with self.connect() as connection:
+                connection.execute(*create_index_query).close()
+        except sqlite3.IntegrityError:
+            if not index.unique:
+                raise
 
-                create_table_query: Tuple[str, List[Any]] = (
-                    f"CREATE TABLE {schema.table_name} ({fields_string})",
-                    [],
-                )
+            # existing rows violate the constraint,
+            # fall back to a plain index for lookups
+            logger.warning(
+                f"unable to create unique index on {schema.table_name} "
+                f"({fields_string}), creating non unique index instead"
+            )
+
+            self.create_index(schema, Index(*index.fields, where=index.where))
+
+
+class GroupCommit:
+    def __init__(
+        self, session: Session, window: float = 0.002, size: int = 256
+    ) -> None:
+        self.session = session
 
-                logger.info(create_table_query)
+        # seconds to wait for more writes after the first write of a batch
+        self.window = window
+        self.size = size
 
-                cursor.execute(*create_table_query)
+        self.queue: queue.Queue[
+            Optional[Tuple[Callable[[], Any], Future[Any]]]
+        ] = queue.Queue()
+
+        # a single writer commits batches of writes in one transaction
+        self.thread = threading.Thread(
+            target=self.run, name="group-commit", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, write: Callable[[], Any]) -> Future[Any]:
+        future: Future[Any] = Future()
+
+        self.queue.put((write, future))
+
+        return future
+
+    def collect(self) -> Optional[List[Tuple[Callable[[], Any], Future[Any]]]]:
+        item = self.queue.get()
+
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.size:
+            timeout = deadline - time.monotonic()
+
+            if timeout <= 0:
+                break
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if item is None:
+                # stop after this batch
+                self.queue.put(None)
+
+                break
+
+            batch.append(item)
+
+        return batch
+
+    def write(
+        self, batch: List[Tuple[Callable[[], Any], Future[Any]]]
+    ) -> None:
+        results: List[Tuple[Future[Any], Any, Optional[Exception]]] = []
+
+        try:
+            with self.session.transaction():
+                for write, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+
+                    # a failing write only rolls back its own savepoint
+                    try:
+                        with self.session.transaction():
+                            results.append((future, write(), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.exception("group commit failed")
+
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+            return
+
+        # writes are only reported once they are committed
+        for future, result, exception in results:
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
+
+    def run(self) -> None:
+        while True:
+            batch = self.collect()
+
+            if batch is None:
+                break
+
+            logger.info(f"group commit of {len(batch)} writes")
+
+            self.write(batch)
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
 
 
 if __name__ == "__main__":
@@ -357,3 +908,5 @@ if __name__ == "__main__":
     # test = query.select("id").where(name="foobar").fetch_one()
 
     # print(test)
+
+    session.close()
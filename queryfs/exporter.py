@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import logging
+import os
+import stat
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from queryfs import PathLike
+from queryfs.blobs import BlobReader, BlobStore, ChunkedReader
+from queryfs.cloning import DEFAULT_BUFFER_SIZE, clone, copy_buffered
+from queryfs.compression import DEFAULT_FRAME_SIZE, get_codec
+from queryfs.db.session import Constraint, Session
+from queryfs.models.chunk import Chunk
+from queryfs.models.directory import Directory
+from queryfs.models.file import File
+from queryfs.models.setting import Setting
+
+logger = logging.getLogger("exporter")
+
+# all directories and files below a directory with their paths relative
+# to it, parents are listed before their entries
+EXPORT_QUERY = " ".join(
+    [
+        "WITH RECURSIVE tree(id, path, mode, atime, mtime) AS (",
+        "SELECT :directory_id, '', NULL, NULL, NULL",
+        "UNION ALL",
+        "SELECT directories.id, tree.path || directories.name || '/',",
+        "directories.mode, directories.atime, directories.mtime",
+        "FROM directories JOIN tree ON directories.directory_id IS tree.id",
+        ")",
+        "SELECT 0, path, NULL, 0, mode, atime, mtime FROM tree",
+        "WHERE path != ''",
+        "UNION ALL",
+        "SELECT 1, tree.path || files.name, files.hash, files.size,",
+        "files.mode, files.atime, files.mtime",
+        "FROM files JOIN tree ON files.directory_id IS tree.id",
+        "ORDER BY 1, 2",
+    ]
+)
+
+# entry as (is file, path, hash, size, mode, atime, mtime)
+Row = Tuple[int, str, Optional[str], int, Optional[int], Any, Any]
+
+
+def open_blob_store(session: Session, root: PathLike) -> BlobStore:
+    # reads the recorded settings without recording defaults, blobs of
+    # all layouts are located regardless of the recorded layout
+    settings: Dict[str, str] = {
+        x.name: x.value
+        for x in session.query(Setting)
+        .select("name", "value")
+        .execute()
+        .fetch_iter()
+    }
+
+    codec_name = settings.get("compression", "none")
+
+    return BlobStore(
+        root,
+        None if codec_name == "none" else get_codec(codec_name),
+        int(settings.get("compression_frame_size", DEFAULT_FRAME_SIZE)),
+        int(settings.get("blob_layout", 0)),
+    )
+
+
+class Exporter:
+    def __init__(
+        self,
+        session: Session,
+        blob_store: BlobStore,
+        workers: Optional[int] = None,
+        link: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> None:
+        self.session = session
+        self.blob_store = blob_store
+
+        # files are materialized on a thread pool
+        self.executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="export"
+        )
+
+        # hardlink blobs whose mode and modification time match the
+        # recorded ones instead of cloning them, exported files share the
+        # inode with the blob and must not be changed
+        self.link = link
+        self.buffer_size = buffer_size
+
+        # files exported per method
+        self.methods: Counter[str] = Counter()
+
+        self.directories = 0
+        self.files = 0
+
+    def resolve(self, path: PathLike) -> Optional[Union[File, Directory]]:
+        entity: Optional[Union[File, Directory]] = None
+
+        for part in [x for x in str(path).split("/") if x]:
+            if isinstance(entity, File):
+                raise NotADirectoryError(path)
+
+            constraints = [
+                Constraint("name", "is", part),
+                Constraint(
+                    "directory_id", "is", entity.id if entity else None
+                ),
+            ]
+
+            entity = (
+                self.session.query(Directory)
+                .select()
+                .where(*constraints)
+                .execute()
+                .fetch_one()
+            ) or (
+                self.session.query(File)
+                .select()
+                .where(*constraints)
+                .execute()
+                .fetch_one()
+            )
+
+            if entity is None:
+                raise FileNotFoundError(path)
+
+        return entity
+
+    def run(self, path: PathLike, destination: PathLike) -> Tuple[int, int]:
+        destination = Path(destination)
+        entity = self.resolve(path)
+
+        if isinstance(entity, File):
+            destination.parent.mkdir(parents=True, exist_ok=True)
+
+            self.methods[
+                self.export_file(
+                    entity.hash,
+                    entity.size,
+                    entity.mode,
+                    entity.atime,
+                    entity.mtime,
+                    destination,
+                )
+            ] += 1
+
+            self.files += 1
+
+            self.executor.shutdown()
+
+            return self.directories, self.files
+
+        destination.mkdir(parents=True, exist_ok=True)
+
+        directories: List[Tuple[Path, Row]] = []
+
+        if isinstance(entity, Directory):
+            directories.append(
+                (
+                    destination,
+                    (0, "", None, 0, entity.mode, entity.atime, entity.mtime),
+                )
+            )
+
+        with closing(self.session.connect().cursor()) as cursor:
+            cursor.execute(
+                EXPORT_QUERY,
+                {"directory_id": entity.id if entity else None},
+            )
+
+            # directories are created in order, files in parallel
+            for rows in iter(lambda: cursor.fetchmany(1024), []):
+                futures = []
+
+                for row in rows:
+                    is_file, row_path, hash, size, mode, atime, mtime = row
+                    target = destination.joinpath(row_path)
+
+                    if not is_file:
+                        target.mkdir(exist_ok=True)
+
+                        directories.append((target, row))
+
+                        self.directories += 1
+
+                        continue
+
+                    futures.append(
+                        self.executor.submit(
+                            self.export_file,
+                            hash or "",
+                            size,
+                            mode,
+                            atime,
+                            mtime,
+                            target,
+                        )
+                    )
+
+                for future in futures:
+                    try:
+                        self.methods[future.result()] += 1
+                    except OSError as e:
+                        logger.warning(f"unable to export '{e.filename}'")
+
+                        continue
+
+                    self.files += 1
+
+        # directory attributes are set once their entries are written,
+        # entries first
+        for target, (_, _, _, _, mode, atime, mtime) in reversed(directories):
+            self.set_attributes(target, mode, atime, mtime)
+
+        self.executor.shutdown()
+
+        logger.info(
+            " ".join([f"{x}={y}" for x, y in self.methods.most_common()])
+        )
+
+        return self.directories, self.files
+
+    def open_reader(self, hash: str) -> BlobReader:
+        if self.blob_store.exists(hash):
+            return self.blob_store.open_reader(hash)
+
+        chunks = sorted(
+            self.session.query(Chunk)
+            .select()
+            .where(Constraint("hash", "=", hash))
+            .execute()
+            .fetch_all(),
+            key=lambda x: x.position,
+        )
+
+        if not chunks:
+            raise FileNotFoundError(hash)
+
+        return ChunkedReader(
+            self.blob_store, [(x.offset, x.size, x.chunk_hash) for x in chunks]
+        )
+
+    def export_file(
+        self,
+        hash: str,
+        size: int,
+        mode: Optional[int],
+        atime: Any,
+        mtime: Any,
+        target: Path,
+    ) -> str:
+        # returns the name of the method used
+        blob_path = self.blob_store.locate(hash)
+
+        # plain blobs are shared or cloned, compressed and chunked blobs
+        # are decoded
+        if blob_path is not None and self.blob_store.codec is None:
+            if (
+                self.link
+                and self.matches_blob(blob_path, mode, mtime)
+                and self.link_file(blob_path, target)
+            ):
+                return "hardlink"
+
+            source_fd = os.open(blob_path, os.O_RDONLY)
+
+            try:
+                target_fd = self.open_target(target)
+
+                try:
+                    method = clone(source_fd, target_fd, size)
+                finally:
+                    os.close(target_fd)
+            finally:
+                os.close(source_fd)
+        else:
+            reader = self.open_reader(hash)
+
+            try:
+                target_fd = self.open_target(target)
+
+                try:
+                    copy_buffered(
+                        reader.read, target_fd, size, self.buffer_size
+                    )
+                finally:
+                    os.close(target_fd)
+            finally:
+                reader.close()
+
+            method = "decoded"
+
+        self.set_attributes(target, mode, atime, mtime)
+
+        return method
+
+    def open_target(self, target: Path) -> int:
+        return os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    def matches_blob(
+        self, blob_path: Path, mode: Optional[int], mtime: Any
+    ) -> bool:
+        # linked files share the inode and with it the attributes of the
+        # blob, files with other attributes are cloned instead
+        st = os.stat(blob_path)
+
+        if mode is not None and stat.S_IMODE(mode) != stat.S_IMODE(
+            st.st_mode
+        ):
+            return False
+
+        return mtime is None or mtime == st.st_mtime
+
+    def link_file(self, blob_path: Path, target: Path) -> bool:
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.link(blob_path, target)
+        except OSError:
+            # blobs on other file systems are cloned instead
+            return False
+
+        return True
+
+    def set_attributes(
+        self, target: Path, mode: Optional[int], atime: Any, mtime: Any
+    ) -> None:
+        if mode is not None:
+            os.chmod(target, stat.S_IMODE(mode))
+
+        if atime is not None and mtime is not None:
+            os.utime(target, (atime, mtime))
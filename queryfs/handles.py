@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import errno
+import os
+import threading
+
+from pathlib import Path
+from typing import Any, Optional
+from queryfs.blobs import BlobReader
+from queryfs.models.file import File
+from fuse import FuseOSError
+
+
+class FileHandle:
+    def __init__(
+        self,
+        fh: int,
+        path: str,
+        backing_path: Path,
+        flags: int,
+        entity: Optional[File] = None,
+        directory_id: Optional[int] = None,
+    ) -> None:
+        # path relative to the mount point, used as dentry cache key
+        self.fh = fh
+        self.path = path
+        self.file_name = os.path.basename(path)
+
+        # blob or temp file the handle was opened on
+        self.backing_path = backing_path
+        self.flags = flags
+
+        # committed file and parent directory at the time of opening
+        self.entity = entity
+        self.directory_id = directory_id
+
+        # owner of files created through the handle
+        self.uid: Optional[int] = None
+        self.gid: Optional[int] = None
+
+        # os level file descriptor of temp files
+        self.fd: Optional[int] = None
+
+        # reader of committed blobs for readable handles
+        self.reader: Optional[BlobReader] = None
+
+        # incremental hash of sequential writes, dropped on the first
+        # write that does not continue where the previous one ended
+        self.hasher: Optional[Any] = None
+        self.hashed_offset = 0
+
+        # files unlinked while open are discarded instead of committed
+        self.deleted = False
+
+        # serializes writes through this handle
+        self.lock = threading.Lock()
+
+    def update_hash(self, data: bytes, offset: int) -> None:
+        # the hasher may be dropped by other handles at any time
+        hasher = self.hasher
+
+        if hasher is None:
+            return
+
+        if offset != self.hashed_offset:
+            self.hasher = None
+
+            return
+
+        hasher.update(data)
+        self.hashed_offset += len(data)
+
+    def get_fd(self) -> int:
+        if self.fd is None:
+            raise FuseOSError(errno.EBADF)
+
+        return self.fd
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+
+            self.fd = None
+
+        if self.reader is not None:
+            self.reader.close()
+
+            self.reader = None
+
+    @property
+    def writable(self) -> bool:
+        return self.flags & os.O_ACCMODE != os.O_RDONLY
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} fh='{self.fh}' path='{self.path}' "
+            f"backing_path='{self.backing_path}' at {hex(id(self))}>"
+        )
@@ -1,20 +1,179 @@
-from hashlib import sha256
+import hashlib
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union
+from typing import Any, List, Optional, Union
 
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_BUFFER_SIZE = 1 << 20
 
-def hash_from_file(path: Union[str, Path]) -> str:
-    sha256_hash = sha256()
 
-    with open(path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+class TreeHash:
+    # hash of the concatenated digests of fixed size chunks,
+    # computed sequentially so it matches Hasher.hash_file
+    def __init__(self, algorithm: str, chunk_size: int) -> None:
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
 
-    return sha256_hash.hexdigest()
+        self.digests: List[bytes] = []
+        self.chunk = hashlib.new(algorithm)
+        self.chunk_length = 0
 
+    def update(self, data: bytes) -> None:
+        view = memoryview(data)
 
-def hash_from_bytes(buffer: bytes) -> str:
-    sha256_hash = sha256()
-    sha256_hash.update(buffer)
+        while view:
+            length = min(len(view), self.chunk_size - self.chunk_length)
+
+            self.chunk.update(view[:length])
+            self.chunk_length += length
+
+            view = view[length:]
+
+            if self.chunk_length == self.chunk_size:
+                self.digests.append(self.chunk.digest())
+
+                self.chunk = hashlib.new(self.algorithm)
+                self.chunk_length = 0
+
+    def hexdigest(self) -> str:
+        digests = list(self.digests)
+
+        # an empty file still consists of one empty chunk
+        if self.chunk_length or not digests:
+            digests.append(self.chunk.digest())
+
+        return combine_digests(self.algorithm, digests)
+
+
+class Hasher:
+    def __init__(
+        self,
+        algorithm: str = DEFAULT_ALGORITHM,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        tree_chunk_size: int = 0,
+        workers: Optional[int] = None,
+    ) -> None:
+        if algorithm not in hashlib.algorithms_available:
+            raise ValueError(f"Unsupported hash algorithm '{algorithm}'")
+
+        # variable length digests like shake need a length for hexdigest
+        if not hashlib.new(algorithm).digest_size:
+            raise ValueError(f"Unsupported hash algorithm '{algorithm}'")
+
+        self.algorithm = algorithm
+        self.buffer_size = buffer_size
+
+        # hash chunks of this size in parallel, 0 hashes files as a whole
+        self.tree_chunk_size = tree_chunk_size
+        self.workers = workers
+
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.executor_lock = threading.Lock()
+
+    def create(self) -> Any:
+        if self.tree_chunk_size:
+            return TreeHash(self.algorithm, self.tree_chunk_size)
+
+        return hashlib.new(self.algorithm)
+
+    def hash_bytes(self, buffer: bytes) -> str:
+        hash = self.create()
+        hash.update(buffer)
+
+        digest: str = hash.hexdigest()
+
+        return digest
+
+    def hash_file(self, path: Union[str, Path]) -> str:
+        if not self.tree_chunk_size:
+            hash = self.create()
+
+            with open(path, "rb", buffering=0) as f:
+                for byte_block in iter(lambda: f.read(self.buffer_size), b""):
+                    hash.update(byte_block)
+
+            digest: str = hash.hexdigest()
+
+            return digest
+
+        fd = os.open(path, os.O_RDONLY)
 
-    return sha256_hash.hexdigest()
+        try:
+            size = os.fstat(fd).st_size
+            offsets = range(0, max(size, 1), self.tree_chunk_size)
+
+            if len(offsets) == 1:
+                digests = [self.hash_chunk(fd, 0, size)]
+            else:
+                # hashlib releases the gil for large buffers
+                with self.executor_lock:
+                    if self.executor is None:
+                        self.executor = ThreadPoolExecutor(self.workers)
+
+                    executor = self.executor
+
+                digests = list(
+                    executor.map(
+                        lambda x: self.hash_chunk(
+                            fd, x, min(self.tree_chunk_size, size - x)
+                        ),
+                        offsets,
+                    )
+                )
+        finally:
+            os.close(fd)
+
+        return combine_digests(self.algorithm, digests)
+
+    def hash_chunk(self, fd: int, offset: int, length: int) -> bytes:
+        hash = hashlib.new(self.algorithm)
+        end = offset + length
+
+        while offset < end:
+            byte_block = os.pread(
+                fd, min(self.buffer_size, end - offset), offset
+            )
+
+            if not byte_block:
+                break
+
+            hash.update(byte_block)
+            offset += len(byte_block)
+
+        return hash.digest()
+
+    def close(self) -> None:
+        with self.executor_lock:
+            executor = self.executor
+
+            self.executor = None
+
+        if executor is not None:
+            executor.shutdown()
+
+
+def combine_digests(algorithm: str, digests: List[bytes]) -> str:
+    hash = hashlib.new(algorithm)
+
+    for digest in digests:
+        hash.update(digest)
+
+    return hash.hexdigest()
+
+
+default_hasher = Hasher()
+
+
+def create_hash() -> Any:
+    return default_hasher.create()
+
+
+def hash_from_file(path: Union[str, Path]) -> str:
+    return default_hasher.hash_file(path)
+
+
+def hash_from_bytes(buffer: bytes) -> str:
+    return default_hasher.hash_bytes(buffer)
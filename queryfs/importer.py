@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import logging
+import os
+import stat
+
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from queryfs import PathLike
+from queryfs.db.session import Constraint
+from queryfs.models.chunk import Chunk
+from queryfs.models.directory import Directory
+from queryfs.models.file import File
+# files are stored and recorded through the operations of the file
+# system, importing requires fusepy and libfuse like mounting does
+from queryfs.passthrough import Passthrough
+
+logger = logging.getLogger("importer")
+
+# file to import as (path, name, directory id, stat)
+Entry = Tuple[str, str, Optional[int], os.stat_result]
+
+# stored file as (entry, hash, chunk rows, pinned hashes)
+Stored = Tuple[Entry, str, List[Dict[str, Any]], List[str]]
+
+
+class Importer:
+    def __init__(
+        self,
+        operations: Passthrough,
+        workers: Optional[int] = None,
+        batch_size: int = 10000,
+        link: bool = False,
+    ) -> None:
+        self.operations = operations
+        self.session = operations.session
+
+        # files are hashed and stored on a thread pool, hashlib and file
+        # copies release the gil
+        self.executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="import"
+        )
+
+        # files recorded per transaction
+        self.batch_size = batch_size
+
+        # hardlink source files into the blob store instead of copying,
+        # the source files must not be changed afterwards
+        self.link = link
+
+        self.directories = 0
+        self.files = 0
+
+    def run(self, source: PathLike) -> Tuple[int, int]:
+        entries = self.walk(Path(source))
+        previous: List[Future[Stored]] = []
+
+        # files of the next batch are stored while the previous batch is
+        # recorded, directories are recorded while they are walked
+        while True:
+            with self.session.transaction():
+                batch = list(islice(entries, self.batch_size))
+                futures = [self.executor.submit(self.store, x) for x in batch]
+
+                self.record(previous)
+
+            previous = futures
+
+            if not batch:
+                break
+
+        self.executor.shutdown()
+
+        return self.directories, self.files
+
+    def walk(self, source: Path) -> Iterator[Entry]:
+        # directories as (path, id, whether it existed before the import)
+        stack: List[Tuple[str, Optional[int], bool]] = [
+            (str(source), None, True)
+        ]
+
+        while stack:
+            path, directory_id, existed = stack.pop()
+
+            directories: List[os.DirEntry[str]] = []
+            files: List[os.DirEntry[str]] = []
+
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry)
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(entry)
+                    else:
+                        # the repository only stores files and directories
+                        logger.warning(f"skipping '{entry.path}'")
+
+            existing_names: Set[str] = set()
+
+            if existed:
+                existing_names = set(
+                    [
+                        x.name
+                        for x in self.session.query(File)
+                        .select("name")
+                        .where(Constraint("directory_id", "is", directory_id))
+                        .execute()
+                        .fetch_iter()
+                    ]
+                )
+
+            for entry, child_id, child_existed in self.insert_directories(
+                directory_id, directories, existed
+            ):
+                stack.append((entry.path, child_id, child_existed))
+
+            for entry in files:
+                if entry.name in existing_names:
+                    logger.warning(f"skipping existing file '{entry.path}'")
+
+                    continue
+
+                yield (
+                    entry.path,
+                    entry.name,
+                    directory_id,
+                    entry.stat(follow_symlinks=False),
+                )
+
+    def insert_directories(
+        self,
+        directory_id: Optional[int],
+        entries: List[os.DirEntry[str]],
+        existed: bool,
+    ) -> List[Tuple[os.DirEntry[str], int, bool]]:
+        existing: Dict[str, int] = {}
+
+        if existed:
+            existing = {
+                x.name: x.id
+                for x in self.session.query(Directory)
+                .select("id", "name")
+                .where(Constraint("directory_id", "is", directory_id))
+                .execute()
+                .fetch_iter()
+            }
+
+        new_entries = [x for x in entries if x.name not in existing]
+        ctime = time()
+        rows: List[Dict[str, Any]] = []
+
+        for entry in new_entries:
+            st = entry.stat(follow_symlinks=False)
+
+            rows.append(
+                {
+                    "name": entry.name,
+                    "directory_id": directory_id,
+                    "mode": stat.S_IFDIR | stat.S_IMODE(st.st_mode),
+                    "uid": st.st_uid,
+                    "gid": st.st_gid,
+                    "nlink": 2,
+                    "ctime": ctime,
+                    "atime": st.st_atime,
+                    "mtime": st.st_mtime,
+                }
+            )
+
+        row_ids = (
+            self.session.query(Directory)
+            .insert_many(rows)
+            .execute()
+            .get_row_ids()
+        )
+
+        if rows:
+            # new subdirectories link to their parent
+            if existed:
+                self.operations.update_directory(
+                    directory_id, ctime, len(rows)
+                )
+            else:
+                self.session.connect().execute(
+                    "UPDATE directories SET nlink = nlink + ? WHERE id = ?",
+                    [len(rows), directory_id],
+                ).close()
+
+        self.directories += len(rows)
+
+        existing_entries = [
+            (x, existing[x.name], True) for x in entries if x.name in existing
+        ]
+
+        return existing_entries + [
+            (x, y, False) for x, y in zip(new_entries, row_ids)
+        ]
+
+    def store(self, entry: Entry) -> Stored:
+        path, _, _, st = entry
+        pinned: List[str] = []
+
+        try:
+            hash = self.operations.hasher.hash_file(path)
+
+            chunks = self.operations.store_blob(
+                hash, Path(path), st.st_size, pinned, self.link
+            )
+        except BaseException:
+            self.operations.reclaimer.unpin(pinned)
+
+            raise
+
+        return entry, hash, chunks, pinned
+
+    def record(self, futures: List[Future[Stored]]) -> None:
+        # called within a transaction
+        reclaimer = self.operations.reclaimer
+        ctime = time()
+
+        rows: List[Dict[str, Any]] = []
+        references: Counter[str] = Counter()
+        sizes: Dict[str, int] = {}
+        pinned: List[str] = []
+
+        for future in futures:
+            try:
+                entry, hash, chunks, stored_pinned = future.result()
+            except OSError as e:
+                logger.warning(f"skipping '{e.filename}': {e.strerror}")
+
+                continue
+
+            _, name, directory_id, st = entry
+
+            pinned += stored_pinned
+
+            # files with the same content may be stored within a batch
+            if chunks and not self.operations.load_chunks(hash):
+                self.session.query(Chunk).insert_many(chunks).execute().close()
+
+                for chunk in chunks:
+                    references[chunk["chunk_hash"]] += 1
+                    sizes[chunk["chunk_hash"]] = chunk["size"]
+
+            references[hash] += 1
+            sizes[hash] = st.st_size
+
+            rows.append(
+                {
+                    "name": name,
+                    "hash": hash,
+                    "ctime": ctime,
+                    "atime": st.st_atime,
+                    "mtime": st.st_mtime,
+                    "size": st.st_size,
+                    "directory_id": directory_id,
+                    "mode": stat.S_IFREG | stat.S_IMODE(st.st_mode),
+                    "uid": st.st_uid,
+                    "gid": st.st_gid,
+                    "nlink": 1,
+                }
+            )
+
+        try:
+            self.session.query(File).insert_many(rows).execute().close()
+
+            for hash, count in references.items():
+                reclaimer.reference(hash, sizes[hash], count)
+        finally:
+            reclaimer.unpin(pinned)
+
+        self.files += len(rows)
+
+        if rows:
+            logger.info(f"imported {self.files} files")
@@ -0,0 +1,26 @@
+from collections import OrderedDict
+from typing import List
+from queryfs.db.schema import Index, Schema
+
+
+class Blob(Schema):
+    table_name: str = "blobs"
+    fields: OrderedDict[str, str] = OrderedDict(
+        {
+            "id": "integer primary key autoincrement",
+            "hash": "text",
+            "size": "integer",
+            "refcount": "integer",
+            "ctime": "real",
+        }
+    )
+    indexes: List[Index] = [
+        Index("hash", unique=True),
+        Index("refcount"),
+    ]
+
+    id: int = 0
+    hash: str = ""
+    size: int = 0
+    refcount: int = 0
+    ctime: float = 0.0
@@ -0,0 +1,28 @@
+from collections import OrderedDict
+from typing import List
+from queryfs.db.schema import Index, Schema
+
+
+class Chunk(Schema):
+    table_name: str = "chunks"
+    fields: OrderedDict[str, str] = OrderedDict(
+        {
+            "id": "integer primary key autoincrement",
+            "hash": "text",
+            "position": "integer",
+            "offset": "integer",
+            "size": "integer",
+            "chunk_hash": "text",
+        }
+    )
+    indexes: List[Index] = [
+        Index("hash", "position", unique=True),
+        Index("chunk_hash"),
+    ]
+
+    id: int = 0
+    hash: str = ""
+    position: int = 0
+    offset: int = 0
+    size: int = 0
+    chunk_hash: str = ""
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 from collections import OrderedDict
-from typing import Any, Dict, Optional
-from queryfs.db.schema import Schema
+from typing import Any, Dict, List, Optional
+from queryfs.db.schema import Index, Schema
 
 
 class Directory(Schema):
@@ -12,14 +12,30 @@ class Directory(Schema):
             "id": "integer primary key autoincrement",
             "name": "text",
             "directory_id": "integer null",
+            "mode": "integer null",
+            "uid": "integer null",
+            "gid": "integer null",
+            "nlink": "integer null",
+            "ctime": "real null",
+            "atime": "real null",
+            "mtime": "real null",
         }
     )
+    indexes: List[Index] = [
+        Index("directory_id", "name", unique=True),
+        # null directory ids of entries at the root are distinct
+        Index("name", unique=True, where="directory_id IS NULL"),
+    ]
 
     id: int = 0
     name: str = ""
     hash: str = ""
-    ctime: float = 0.0
-    atime: float = 0.0
-    mtime: float = 0.0
     size: int = 0
     directory_id: Optional[int] = None
+    mode: Optional[int] = None
+    uid: Optional[int] = None
+    gid: Optional[int] = None
+    nlink: Optional[int] = None
+    ctime: Optional[float] = None
+    atime: Optional[float] = None
+    mtime: Optional[float] = None
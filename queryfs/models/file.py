@@ -1,6 +1,6 @@
 from collections import OrderedDict
-from typing import Optional
-from queryfs.db.schema import Schema
+from typing import List, Optional
+from queryfs.db.schema import Index, Schema
 
 
 class File(Schema):
@@ -15,8 +15,19 @@ class File(Schema):
             "mtime": "real",
             "size": "integer",
             "directory_id": "integer null",
+            "mode": "integer null",
+            "uid": "integer null",
+            "gid": "integer null",
+            "nlink": "integer null",
         }
     )
+    indexes: List[Index] = [
+        Index("directory_id", "name", unique=True),
+        # null directory ids of entries at the root are distinct
+        Index("name", unique=True, where="directory_id IS NULL"),
+        Index("name"),
+        Index("hash"),
+    ]
 
     id: int = 0
     name: str = ""
@@ -26,3 +37,7 @@ class File(Schema):
     mtime: float = 0.0
     size: int = 0
     directory_id: Optional[int] = 0
+    mode: Optional[int] = None
+    uid: Optional[int] = None
+    gid: Optional[int] = None
+    nlink: Optional[int] = None
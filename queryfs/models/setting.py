@@ -0,0 +1,19 @@
+from collections import OrderedDict
+from typing import List
+from queryfs.db.schema import Index, Schema
+
+
+class Setting(Schema):
+    table_name: str = "settings"
+    fields: OrderedDict[str, str] = OrderedDict(
+        {
+            "id": "integer primary key autoincrement",
+            "name": "text",
+            "value": "text",
+        }
+    )
+    indexes: List[Index] = [Index("name", unique=True)]
+
+    id: int = 0
+    name: str = ""
+    value: str = ""
@@ -7,17 +7,69 @@ import os
 import sys
 import errno
 import json
-
+import sqlite3
+import stat
+import uuid
+import itertools
+import threading
+
+from concurrent.futures import Future
+from contextlib import closing
+from functools import lru_cache
 from shutil import copyfile
 from time import time
 from pathlib import Path
-from typing import Any, Callable, Optional, Dict, Union, Tuple, List
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    Optional,
+    Dict,
+    Union,
+    Tuple,
+    List,
+)
 from queryfs import db, PathLike
-from queryfs.db.session import Constraint, Session
+from queryfs.attributes import (
+    directory_attributes,
+    file_attributes,
+    stat_attributes,
+)
+from queryfs.blobs import DEFAULT_LAYOUT, BlobReader, BlobStore, ChunkedReader
+from queryfs.chunking import Chunker
+from queryfs.cloning import CopyUp, copy_range, reflink
+from queryfs.compression import DEFAULT_FRAME_SIZE, get_codec
+from queryfs.cache import MISSING, DentryCache
+from queryfs.handles import FileHandle
+from queryfs.commit import CommitPipeline
+from queryfs.reclaim import BlobReclaimer
+from queryfs.tree import delete_tree, has_children, is_within_tree
+from queryfs.db.session import Constraint, GroupCommit, Session
 from queryfs.models.file import File
 from queryfs.models.directory import Directory
-from queryfs.hashing import hash_from_bytes, hash_from_file
-from fuse import FUSE, FuseOSError, Operations, LoggingMixIn
+from queryfs.models.chunk import Chunk
+from queryfs.models.blob import Blob
+from queryfs.models.setting import Setting
+from queryfs.hashing import DEFAULT_ALGORITHM, DEFAULT_BUFFER_SIZE, Hasher
+from fuse import (
+    FUSE,
+    FuseOSError,
+    Operations,
+    LoggingMixIn,
+    fuse_get_context,
+)
+
+logger = logging.getLogger("passthrough")
+
+# attributes of the root directory recorded as settings
+ROOT_ATTRIBUTES: Dict[str, Callable[[str], Any]] = {
+    "mode": int,
+    "uid": int,
+    "gid": int,
+    "atime": float,
+    "mtime": float,
+    "ctime": float,
+}
 
 
 def format_kwargs(**kwargs: Any) -> str:
@@ -28,8 +80,102 @@ def format_lifecycle_step(name: str, **kwargs: Any) -> str:
     return f"{name}: {format_kwargs(**kwargs)}"
 
 
+def split_path(path: PathLike) -> List[str]:
+    return list(filter(bool, str(path).split("/")))
+
+
+def path_key(path: PathLike) -> str:
+    return "/".join(split_path(path))
+
+
+def padded_columns(table_name: str, fields: List[str]) -> str:
+    # directories and files are selected into the same result columns,
+    # the first column tells them apart
+    width = max(len(Directory.fields), len(File.fields))
+    padding = ["NULL"] * (width - len(fields))
+
+    return ", ".join([f"{table_name}.{x}" for x in fields] + padding)
+
+
+def entity_from_row(row: Tuple[Any, ...]) -> Union[File, Directory]:
+    if row[0] == 0:
+        return Directory(*row[1 : len(Directory.fields) + 1])
+
+    return File(*row[1 : len(File.fields) + 1])
+
+
+@lru_cache(maxsize=None)
+def resolve_path_query() -> str:
+    # resolve a whole path in a single statement by walking the directories
+    # table one path component per recursion step, the last component is
+    # either a directory at the full depth or a file in the directory above
+    columns = padded_columns
+
+    return " ".join(
+        [
+            "WITH RECURSIVE",
+            "walk(depth, id) AS (",
+            "SELECT -1, :directory_id",
+            "UNION ALL",
+            "SELECT walk.depth + 1, directories.id FROM walk",
+            "JOIN directories ON directories.directory_id IS walk.id",
+            "AND directories.name =",
+            "json_extract(:parts, '$[' || (walk.depth + 1) || ']')",
+            "WHERE walk.depth < :depth",
+            ")",
+            f"SELECT 0, {columns('directories', list(Directory.fields))}",
+            "FROM directories WHERE directories.id IN",
+            "(SELECT id FROM walk WHERE depth = :depth)",
+            "UNION ALL",
+            f"SELECT 1, {columns('files', list(File.fields))}",
+            "FROM files JOIN walk ON files.directory_id IS walk.id",
+            "WHERE walk.depth = :depth - 1 AND files.name = :name",
+            "ORDER BY 1 LIMIT 1",
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def list_directory_query() -> str:
+    # list directories and files of a directory in a single statement
+    columns = padded_columns
+
+    return " ".join(
+        [
+            f"SELECT 0, {columns('directories', list(Directory.fields))}",
+            "FROM directories WHERE directories.directory_id IS :directory_id",
+            "UNION ALL",
+            f"SELECT 1, {columns('files', list(File.fields))}",
+            "FROM files WHERE files.directory_id IS :directory_id",
+        ]
+    )
+
+
 class Passthrough(LoggingMixIn, Operations):
-    def __init__(self, repository: PathLike):
+    def __init__(
+        self,
+        repository: PathLike,
+        pragmas: Optional[Dict[str, Any]] = None,
+        cached_statements: int = 256,
+        dentry_cache_size: int = 4096,
+        listing_cache_size: int = 64,
+        listing_size: int = 65536,
+        resolve_mode: str = "recursive",
+        mmap_reads: bool = False,
+        hash_algorithm: Optional[str] = None,
+        hash_tree_chunk_size: Optional[int] = None,
+        hash_buffer_size: int = DEFAULT_BUFFER_SIZE,
+        hash_workers: Optional[int] = None,
+        chunk_size: int = 0,
+        compression: Optional[str] = None,
+        compression_frame_size: Optional[int] = None,
+        blob_layout: Optional[int] = None,
+        commit_workers: int = 4,
+        group_commit_window: float = 0.0,
+        group_commit_size: int = 256,
+        reclaim_interval: float = 1.0,
+        reclaim_batch_size: int = 1000,
+    ):
         self.repository = Path(repository)
         self.db_name = self.repository.joinpath("queryfs.db")
         self.temp = self.repository.joinpath("temp")
@@ -42,60 +188,422 @@ class Passthrough(LoggingMixIn, Operations):
             if not directory.is_dir():
                 os.makedirs(directory, 0o777, exist_ok=True)
 
+        # serve reads of blob files from shared memory maps
+        self.mmap_reads = mmap_reads
+
+        # create tables
+        self.session = Session(self.db_name, pragmas, cached_statements)
+
+        blobs_exist = self.session.table_exists(Blob)
+
+        self.session.create_table(Directory)
+        self.session.create_table(File)
+        self.session.create_table(Chunk)
+        self.session.create_table(Setting)
+        self.session.create_table(Blob)
+
+        # settings missing from repositories that already contain files
+        # were not recorded when those files were written, they take the
+        # legacy defaults, also if other tools created the settings table
+        self.legacy_repository = bool(
+            self.session.query(File).select("id").execute().fetch_one()
+        )
+
+        # hashing options that change digests are recorded per repository
+        self.hasher = Hasher(
+            self.load_setting(
+                "hash_algorithm", hash_algorithm, DEFAULT_ALGORITHM
+            ),
+            hash_buffer_size,
+            int(
+                self.load_setting(
+                    "hash_tree_chunk_size", hash_tree_chunk_size, 0
+                )
+            ),
+            hash_workers,
+        )
+
+        # blob compression is recorded per repository
+        codec_name = self.load_setting("compression", compression, "none")
+        codec = None if codec_name == "none" else get_codec(codec_name)
+
+        self.blob_store = BlobStore(
+            self.blobs,
+            codec,
+            int(
+                self.load_setting(
+                    "compression_frame_size",
+                    compression_frame_size,
+                    DEFAULT_FRAME_SIZE,
+                )
+            ),
+            # repositories created before layouts were recorded are flat
+            int(
+                self.load_setting(
+                    "blob_layout",
+                    blob_layout,
+                    0 if self.legacy_repository else DEFAULT_LAYOUT,
+                )
+            ),
+        )
+
+        # count references to blobs, blobs without references are
+        # reclaimed in the background
+        self.reclaimer = BlobReclaimer(
+            self.session, self.blob_store, reclaim_interval, reclaim_batch_size
+        )
+
+        if not blobs_exist:
+            self.reclaimer.backfill()
+
+        # split files larger than the average chunk size into chunk blobs
+        self.chunker: Optional[Chunker] = None
+
+        if chunk_size:
+            self.chunker = Chunker(chunk_size)
+
         # create empty blob file
-        self.empty_hash = hash_from_bytes(b"")
+        self.empty_hash = self.hasher.hash_bytes(b"")
 
         # with open(self.blobs.joinpath(self.empty_hash), "wb") as f:
         #     f.write(b"")
 
-        # create tables
-        self.session = Session(self.db_name)
+        # resolve paths in a single recursive query or one query per level
+        self.resolve_mode = resolve_mode
 
-        self.session.create_table(Directory)
-        self.session.create_table(File)
+        # cache resolved paths, including paths that do not exist
+        self.dentry_cache: DentryCache[Union[File, Directory]] = DentryCache(
+            dentry_cache_size
+        )
+
+        # cache directory listings, so attributes of all entries of a
+        # listed directory are answered without further queries
+        self.listing_cache: DentryCache[
+            Dict[str, Union[File, Directory]]
+        ] = DentryCache(listing_cache_size)
+        self.listing_size = listing_size
+
+        # attributes of entries without stored attributes
+        self.default_attributes = stat_attributes(os.lstat(self.repository))
+
+        # the root directory has no database entity, its changed
+        # attributes are recorded as settings and kept in memory
+        self.root_attributes = directory_attributes(
+            None, self.default_attributes
+        )
+        self.root_attributes_lock = threading.Lock()
+
+        settings = self.session.query(Setting).select().execute()
+
+        for setting in settings.fetch_all():
+            key = setting.name[len("root_") :]
+
+            if setting.name.startswith("root_") and key in ROOT_ATTRIBUTES:
+                self.root_attributes[f"st_{key}"] = ROOT_ATTRIBUTES[key](
+                    setting.value
+                )
+
+        self.root_attributes["st_nlink"] += sum(
+            1
+            for _ in self.session.query(Directory)
+            .select("id")
+            .where(Constraint("directory_id", "is", None))
+            .execute()
+            .fetch_iter()
+        )
 
-        # keep track of writable file handles
-        self.writable_file_handles: List[int] = []
+        # keep track of open file handles, next() on the counter is atomic
+        self.file_handles: Dict[int, FileHandle] = {}
+        self.file_handle_ids = itertools.count(1)
+
+        # keep track of temp files staged for paths opened for writing
+        self.staged_files: Dict[str, Path] = {}
+
+        # temp files of committed files whose blobs are copied up lazily
+        self.copy_ups: Dict[Path, CopyUp] = {}
+
+        # paths whose blobs are being staged for writing, set once the
+        # temp file is registered
+        self.staging: Dict[str, threading.Event] = {}
+
+        # guards file handles and staged files, which change together
+        self.handles_lock = threading.RLock()
+
+        # batch metadata writes of concurrent commits into one transaction
+        self.group_commit: Optional[GroupCommit] = None
+
+        if group_commit_window > 0:
+            self.group_commit = GroupCommit(
+                self.session, group_commit_window, group_commit_size
+            )
+
+        # commit released files in the background, 0 commits inline
+        self.commit_pipeline = CommitPipeline(self.commit_file, commit_workers)
 
         # keep track of file lifecycle open / create -> read / write -> release
         self.file_lifecycles: Dict[str, List[str]] = {}
+        self.file_lifecycles_lock = threading.Lock()
+
+    def load_setting(self, name: str, value: Any, default: Any) -> str:
+        setting = (
+            self.session.query(Setting)
+            .select()
+            .where(Constraint("name", "=", name))
+            .execute()
+            .fetch_one()
+        )
+
+        if setting:
+            if value is not None and str(value) != setting.value:
+                logger.warning(
+                    f"repository uses {name}='{setting.value}', "
+                    f"ignoring '{value}'"
+                )
+
+            return setting.value
+
+        if value is None or self.legacy_repository:
+            value = default
+
+        self.session.query(Setting).insert(
+            name=name, value=str(value)
+        ).execute().close()
+
+        return str(value)
+
+    def update_root(self, **kwargs: Any) -> None:
+        # the transaction serialises writers of the root attributes, so the
+        # recorded and the kept attributes change in the same order
+        with self.session.transaction():
+            for key, value in kwargs.items():
+                self.session.query(Setting).delete().where(
+                    Constraint("name", "=", f"root_{key}")
+                ).execute().close()
+
+                self.session.query(Setting).insert(
+                    name=f"root_{key}", value=str(value)
+                ).execute().close()
+
+            with self.root_attributes_lock:
+                for key, value in kwargs.items():
+                    self.root_attributes[f"st_{key}"] = value
 
     def insert_file_lifecycle(self, file_name: str) -> bool:
-        self.file_lifecycles.setdefault(file_name, [])
+        with self.file_lifecycles_lock:
+            self.file_lifecycles.setdefault(file_name, [])
 
-        return file_name in self.file_lifecycles
+            return file_name in self.file_lifecycles
 
     def append_to_file_lifecycle(
         self, file_name: str, lifecycle_name: str, **kwargs: Any
     ) -> None:
-        if file_name in self.file_lifecycles:
-            lifecycle_steps = self.file_lifecycles.setdefault(file_name, [])
+        with self.file_lifecycles_lock:
+            if file_name in self.file_lifecycles:
+                lifecycle_steps = self.file_lifecycles.setdefault(
+                    file_name, []
+                )
+
+                lifecycle_steps.append(
+                    format_lifecycle_step(lifecycle_name, **kwargs)
+                )
+
+    def complete_file_lifecycle(self, file_name: str) -> None:
+        with self.file_lifecycles_lock:
+            if file_name in self.file_lifecycles:
+                lifecycle_steps = self.file_lifecycles.pop(file_name)
+
+                print("=" * 80)
+                print(f"lifecycle complete for: {file_name}")
+                print("=" * 80)
+                print("\n".join(lifecycle_steps))
+
+    def load_chunks(self, hash: str) -> List[Chunk]:
+        chunks = (
+            self.session.query(Chunk)
+            .select()
+            .where(Constraint("hash", "=", hash))
+            .execute()
+            .fetch_all()
+        )
+
+        return sorted(chunks, key=lambda x: x.position)
+
+    def resolve_blob_path(self, file_instance: File) -> Path:
+        blob_path = self.blob_store.locate(file_instance.hash)
+
+        if blob_path is None:
+            # chunked files are represented by their first chunk
+            chunks = self.load_chunks(file_instance.hash)
 
-            lifecycle_steps.append(
-                format_lifecycle_step(lifecycle_name, **kwargs)
+            if chunks:
+                blob_path = self.blob_store.locate(chunks[0].chunk_hash)
+
+        return blob_path or self.blob_store.path(file_instance.hash)
+
+    def load_db_entity(
+        self, path: PathLike
+    ) -> Optional[Union[File, Directory]]:
+        # bypasses the dentry cache, called within write transactions to
+        # see the committed state
+        parts = split_path(path)
+
+        if not parts:
+            return None
+
+        return self.query_db_entity(parts, cached=False)
+
+    def load_file(
+        self, directory_id: Optional[int], name: str
+    ) -> Optional[File]:
+        # bypasses the dentry cache, called within write transactions to
+        # see the committed state
+        return (
+            self.session.query(File)
+            .select()
+            .where(
+                Constraint("name", "is", name),
+                Constraint("directory_id", "is", directory_id),
             )
+            .execute()
+            .fetch_one()
+        )
+
+    def delete_file(self, file_id: int) -> Optional[File]:
+        # called within a transaction, the row is selected again so that
+        # concurrent deletions of the same file dereference its blob once
+        file_instance = (
+            self.session.query(File)
+            .select()
+            .where(Constraint("id", "=", file_id))
+            .execute()
+            .fetch_one()
+        )
+
+        if file_instance is None:
+            return None
+
+        deleted = (
+            self.session.query(File)
+            .delete()
+            .where(Constraint("id", "=", file_id))
+            .execute()
+            .get_row_count()
+        )
+
+        if deleted != 1:
+            return None
+
+        self.reclaimer.dereference(file_instance.hash)
+
+        return file_instance
+
+    def store_blob(
+        self,
+        hash: str,
+        temp_path: Path,
+        size: int,
+        pinned: List[str],
+        link: bool = True,
+    ) -> List[Dict[str, Any]]:
+        # returns the chunk rows to record with the file, stored blobs are
+        # pinned until the file references them
+        self.reclaimer.pin(hash)
+        pinned.append(hash)
+
+        if self.blob_store.exists(hash):
+            return []
+
+        if self.chunker is None or size <= self.chunker.average_size:
+            # the staged file stays visible until the database is updated
+            self.blob_store.put(hash, temp_path, link)
+
+            return []
+
+        if self.load_chunks(hash):
+            return []
+
+        chunks: List[Dict[str, Any]] = []
+        offset = 0
+
+        with open(temp_path, "rb") as f:
+            for position, data in enumerate(self.chunker.chunks(f)):
+                chunk_hash = self.hasher.hash_bytes(data)
+
+                self.reclaimer.pin(chunk_hash)
+                pinned.append(chunk_hash)
+
+                if not self.blob_store.exists(chunk_hash):
+                    self.blob_store.write(chunk_hash, data)
+
+                chunks.append(
+                    {
+                        "hash": hash,
+                        "position": position,
+                        "offset": offset,
+                        "size": len(data),
+                        "chunk_hash": chunk_hash,
+                    }
+                )
+
+                offset += len(data)
+
+        return chunks
+
+    def write_metadata(self, write: Callable[[], None]) -> None:
+        if self.group_commit is None:
+            with self.session.transaction():
+                write()
+
+            return
+
+        self.group_commit.submit(write).result()
 
     def resolve_db_entity(
-        self, path: PathLike, directory: Optional[Directory] = None
+        self, path: PathLike
     ) -> Optional[Union[File, Directory]]:
-        parts = list(filter(bool, str(path).split("/")))
+        parts = split_path(path)
 
         if not parts:
-            return
+            return None
 
-        # get first path element
-        first_link = parts[0]
+        key = "/".join(parts)
 
+        generation = self.dentry_cache.generation
+        entity = self.dentry_cache.get(key)
+
+        if entity is not MISSING:
+            return entity
+
+        listing = self.listing_cache.get("/".join(parts[:-1]))
+
+        if listing is not MISSING and listing is not None:
+            entity = listing.get(parts[-1])
+        elif self.resolve_mode == "walk":
+            entity = self.walk_db_entity(parts)
+        else:
+            entity = self.query_db_entity(parts)
+
+        self.dentry_cache.put(key, entity, generation)
+
+        return entity
+
+    def walk_db_entity(
+        self, parts: List[str]
+    ) -> Optional[Union[File, Directory]]:
         # build constraints
         directory_id = None
 
-        if directory:
-            # add directory id constraint
-            # if directory is not none
-            directory_id = directory.id
+        if len(parts) > 1:
+            # resolve parent directory through the cache
+            parent_instance = self.resolve_db_entity("/".join(parts[:-1]))
+
+            if not isinstance(parent_instance, Directory):
+                return None
+
+            directory_id = parent_instance.id
 
         constraints: List[Constraint] = [
-            Constraint("name", "is", first_link),
+            Constraint("name", "is", parts[-1]),
             Constraint("directory_id", "is", directory_id),
         ]
 
@@ -108,14 +616,9 @@ class Passthrough(LoggingMixIn, Operations):
         )
 
         if directory_instance:
-            if len(parts) > 1:
-                return self.resolve_db_entity(
-                    "/".join(parts[1:]), directory_instance
-                )
-
             return directory_instance
 
-        file_instance = (
+        return (
             self.session.query(File)
             .select()
             .where(*constraints)
@@ -123,25 +626,380 @@ class Passthrough(LoggingMixIn, Operations):
             .fetch_one()
         )
 
-        if file_instance:
-            return file_instance
+    def query_db_entity(
+        self, parts: List[str], cached: bool = True
+    ) -> Optional[Union[File, Directory]]:
+        directory_id = None
+
+        # start from the parent directory if it is already cached
+        if cached and len(parts) > 1:
+            parent_instance = self.dentry_cache.get("/".join(parts[:-1]))
+
+            if isinstance(parent_instance, Directory):
+                directory_id = parent_instance.id
+                parts = parts[-1:]
+
+        values: Dict[str, Any] = {
+            "parts": json.dumps(parts),
+            "directory_id": directory_id,
+            "depth": len(parts) - 1,
+            "name": parts[-1],
+        }
+
+        with closing(self.session.connect().cursor()) as cursor:
+            row = cursor.execute(resolve_path_query(), values).fetchone()
+
+        if not row:
+            return None
+
+        return entity_from_row(row)
+
+    def iter_db_entities(
+        self, directory_id: Optional[int], size: int = 256
+    ) -> Iterator[Union[File, Directory]]:
+        with closing(self.session.connect().cursor()) as cursor:
+            cursor.execute(
+                list_directory_query(), {"directory_id": directory_id}
+            )
+
+            # stream large directories in batches
+            for rows in iter(lambda: cursor.fetchmany(size), []):
+                for row in rows:
+                    yield entity_from_row(row)
+
+    def invalidate_path(self, key: str, tree: bool = False) -> None:
+        parts = split_path(key)
+
+        if tree:
+            self.dentry_cache.invalidate_tree(key)
+            self.listing_cache.invalidate_tree(key)
+        else:
+            self.dentry_cache.invalidate(key)
+
+        # the listing and attributes of the parent directory changed as well
+        if parts:
+            self.listing_cache.invalidate("/".join(parts[:-1]))
+            self.dentry_cache.invalidate("/".join(parts[:-1]))
+            self.listing_cache.invalidate("/".join(parts[:-2]))
+
+    def get_attributes(
+        self, entity: Optional[Union[File, Directory]]
+    ) -> Dict[str, Any]:
+        if isinstance(entity, File):
+            return file_attributes(entity, self.default_attributes)
+
+        if isinstance(entity, Directory):
+            return directory_attributes(entity, self.default_attributes)
+
+        with self.root_attributes_lock:
+            return dict(self.root_attributes)
+
+    def resolve_attribute_entity(
+        self, key: str
+    ) -> Optional[Union[File, Directory]]:
+        # attributes are changed on the committed entry
+        self.commit_pipeline.wait(key)
+
+        entity = self.resolve_db_entity(key)
 
-    def resolve_path(
-        self, path: PathLike, directory: Optional[Directory] = None
-    ) -> Union[File, Directory, PathLike]:
-        parts = list(filter(bool, str(path).split("/")))
+        if entity is None and key and key not in self.staged_files:
+            raise FuseOSError(errno.ENOENT)
+
+        return entity
+
+    def get_owner(self) -> Tuple[int, int]:
+        # entries are owned by the user of the calling process
+        uid, gid, _ = fuse_get_context()
 
-        temp_path = self.temp.joinpath("/".join(parts))
+        return uid, gid
+
+    def update_directory(
+        self, directory_id: Optional[int], mtime: float, links: int = 0
+    ) -> None:
+        # called within a transaction whenever entries of a directory
+        # are added, removed or renamed
+        if directory_id is None:
+            self.update_root(mtime=mtime, ctime=mtime)
 
-        if temp_path.exists():
+            # the link count is derived from the directories on mount
+            with self.root_attributes_lock:
+                self.root_attributes["st_nlink"] += links
+
+            return
+
+        with closing(self.session.connect().cursor()) as cursor:
+            cursor.execute(
+                " ".join(
+                    [
+                        "UPDATE directories SET mtime = ?, ctime = ?,",
+                        "nlink = coalesce(nlink, 2) + ? WHERE id = ?",
+                    ]
+                ),
+                [mtime, mtime, links, directory_id],
+            )
+
+    def update_entity(
+        self, key: str, entity: Union[File, Directory], **kwargs: Any
+    ) -> None:
+        self.session.query(type(entity)).update(**kwargs).where(
+            Constraint("id", "=", entity.id)
+        ).execute().close()
+
+        self.invalidate_path(key)
+
+    def resolve_path(self, path: PathLike) -> Union[File, Directory, PathLike]:
+        key = path_key(path)
+
+        # staged files shadow committed files
+        temp_path = self.staged_files.get(key)
+
+        if temp_path is not None:
             return temp_path
 
-        db_entity = self.resolve_db_entity(path)
+        db_entity = self.resolve_db_entity(key)
 
         if db_entity:
             return db_entity
 
-        return temp_path
+        return self.temp.joinpath(key)
+
+    def resolve_parent_directory_id(self, path: PathLike) -> Optional[int]:
+        parts = split_path(path)
+
+        if len(parts) < 2:
+            return None
+
+        parent_instance = self.resolve_db_entity("/".join(parts[:-1]))
+
+        if not isinstance(parent_instance, Directory):
+            raise FuseOSError(errno.ENOENT)
+
+        return parent_instance.id
+
+    def get_file_handle(self, fh: int) -> FileHandle:
+        try:
+            return self.file_handles[fh]
+        except KeyError:
+            raise FuseOSError(errno.EBADF)
+
+    def open_temp_file(
+        self, flags: int, mode: int = 0o644
+    ) -> Tuple[int, Path]:
+        temp_path = self.temp.joinpath(uuid.uuid4().hex)
+
+        fd = os.open(temp_path, flags | os.O_CREAT | os.O_EXCL, mode)
+
+        return fd, temp_path
+
+    def rename_staged_files(
+        self, old: str, new: str, directory_id: Optional[int]
+    ) -> None:
+        with self.handles_lock:
+            for key in list(self.staged_files.keys()):
+                if key != old and not key.startswith(f"{old}/"):
+                    continue
+
+                new_key = new + key[len(old) :]
+
+                self.staged_files[new_key] = self.staged_files.pop(key)
+
+                for handle in self.file_handles.values():
+                    if handle.path != key:
+                        continue
+
+                    handle.path = new_key
+                    handle.file_name = os.path.basename(new_key)
+
+                    if key == old:
+                        handle.directory_id = directory_id
+
+                        new_result = self.resolve_db_entity(new_key)
+
+                        if isinstance(new_result, File):
+                            # commit into the file that is being replaced
+                            handle.entity = new_result
+
+    def discard_staged_files(self, key: str, tree: bool = False) -> bool:
+        # files that are still being written below deleted paths are
+        # discarded on release instead of committed
+        prefix = f"{key}/"
+
+        while True:
+            # pending commits are recorded before they are deleted
+            self.commit_pipeline.wait(key, tree)
+
+            with self.handles_lock:
+                if self.commit_pipeline.is_pending(key, tree):
+                    # released again in the meantime
+                    continue
+
+                keys = [
+                    x
+                    for x in self.staged_files.keys()
+                    if x == key or (tree and x.startswith(prefix))
+                ]
+
+                for x in keys:
+                    del self.staged_files[x]
+
+                for handle in self.file_handles.values():
+                    if handle.path in keys:
+                        handle.deleted = True
+
+                return bool(keys)
+
+    def commit_file(self, handle: FileHandle) -> None:
+        temp_path = handle.backing_path
+
+        with self.handles_lock:
+            copy_up = self.copy_ups.get(temp_path)
+
+        if copy_up is not None:
+            # the whole file is hashed and stored, the copy up is kept for
+            # a retry if it fails
+            if not handle.deleted:
+                copy_up.complete()
+
+            with self.handles_lock:
+                self.copy_ups.pop(temp_path, None)
+
+            copy_up.close()
+
+        if handle.deleted:
+            os.unlink(temp_path)
+
+            return
+
+        st = temp_path.stat()
+        size = st.st_size
+
+        if handle.hasher is not None and handle.hashed_offset == size:
+            # use hash computed while writing
+            hash = handle.hasher.hexdigest()
+        else:
+            # create hash from file
+            hash = self.hasher.hash_file(temp_path)
+
+        self.append_to_file_lifecycle(
+            handle.file_name, "release -> created hash", hash=hash
+        )
+
+        pinned: List[str] = []
+
+        try:
+            self.store_file(handle, hash, st, pinned)
+        finally:
+            self.reclaimer.unpin(pinned)
+
+        self.invalidate_path(handle.path)
+
+        with self.handles_lock:
+            if self.staged_files.get(handle.path) == temp_path:
+                del self.staged_files[handle.path]
+
+        os.unlink(temp_path)
+
+        self.append_to_file_lifecycle(
+            handle.file_name, "release -> unlinked file", path=temp_path
+        )
+
+    def store_file(
+        self,
+        handle: FileHandle,
+        hash: str,
+        st: os.stat_result,
+        pinned: List[str],
+    ) -> None:
+        temp_path = handle.backing_path
+        size = st.st_size
+        ctime = time()
+
+        # store blob if no blob exists for that hash
+        chunks = self.store_blob(hash, temp_path, size, pinned)
+
+        self.append_to_file_lifecycle(
+            handle.file_name,
+            "release -> stored blob",
+            path=temp_path,
+            hash=hash,
+        )
+
+        def record_file() -> None:
+            # files created concurrently through other handles may have
+            # been committed since this handle was opened, or the file may
+            # have been replaced or removed in the meantime
+            file_instance = self.load_file(
+                handle.directory_id, handle.file_name
+            )
+
+            # files with the same content may be committed concurrently
+            if chunks and not self.load_chunks(hash):
+                self.session.query(Chunk).insert_many(chunks).execute().close()
+
+                for chunk in chunks:
+                    self.reclaimer.reference(
+                        chunk["chunk_hash"], chunk["size"]
+                    )
+
+            self.reclaimer.reference(hash, size)
+
+            if isinstance(file_instance, File):
+                # udpate existing file
+                updated = (
+                    self.session.query(File)
+                    .update(
+                        hash=hash,
+                        ctime=ctime,
+                        atime=st.st_atime,
+                        mtime=st.st_mtime,
+                        size=size,
+                    )
+                    .where(Constraint("id", "=", file_instance.id))
+                    .execute()
+                    .get_row_count()
+                )
+
+                # the previous blob is reclaimed once it is unreferenced
+                if updated == 1:
+                    self.reclaimer.dereference(file_instance.hash)
+
+                self.append_to_file_lifecycle(
+                    handle.file_name,
+                    "release -> updated file",
+                    updated_file_name=file_instance.name,
+                )
+            else:
+                # insert new file, the temp file carries mode and times
+                # set while it was staged
+                self.session.query(File).insert(
+                    name=handle.file_name,
+                    hash=hash,
+                    ctime=ctime,
+                    atime=st.st_atime,
+                    mtime=st.st_mtime,
+                    size=size,
+                    directory_id=handle.directory_id,
+                    mode=stat.S_IFREG | stat.S_IMODE(st.st_mode),
+                    uid=handle.uid,
+                    gid=handle.gid,
+                    nlink=1,
+                ).execute().close()
+
+                self.update_directory(handle.directory_id, ctime)
+
+                self.append_to_file_lifecycle(
+                    handle.file_name,
+                    "release -> inserted file",
+                    new_file_name=handle.file_name,
+                )
+
+        # chunks, file and blob references are recorded in a single
+        # transaction
+        self.write_metadata(record_file)
+
+    def drain(self) -> None:
+        # wait until all released files are committed
+        self.commit_pipeline.drain()
 
     # def rewrite_path(self, path: PathLike) -> PathLike:
     #     path = self.temp.joinpath(str(path)[1:])
@@ -171,11 +1029,28 @@ class Passthrough(LoggingMixIn, Operations):
     # Filesystem methods
     # ==================
 
+    def destroy(self, path: PathLike) -> None:
+        logger.info(f"dentry cache hit rate: {self.dentry_cache.hit_rate:.2%}")
+
+        # wait for pending commits
+        self.commit_pipeline.close()
+
+        if self.group_commit is not None:
+            self.group_commit.close()
+
+        # reclaim blobs released by the last commits
+        self.reclaimer.close()
+
+        # close database connections at unmount
+        self.session.close()
+        self.blob_store.close()
+        self.hasher.close()
+
     def access(self, path: PathLike, amode: int) -> None:
         result = self.resolve_path(path)
 
         if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
+            path = self.resolve_blob_path(result)
         elif isinstance(result, Directory):
             return
         else:
@@ -186,110 +1061,124 @@ class Passthrough(LoggingMixIn, Operations):
         if not os.access(path, amode):
             raise FuseOSError(errno.EACCES)
 
-    chmod = None  # type: ignore
-    # def chmod(self, path, mode):
-    #     full_path = self._full_path(path)
-    #     return os.chmod(full_path, mode)
+    def chmod(self, path: PathLike, mode: int) -> None:
+        key = path_key(path)
+        entity = self.resolve_attribute_entity(key)
 
-    chown = None  # type: ignore
-    # def chown(self, path, uid, gid):
-    #     full_path = self._full_path(path)
-    #     return os.chown(full_path, uid, gid)
+        temp_path = self.staged_files.get(key)
 
-    def getattr(
-        self, path: PathLike, fh: Optional[int] = None
-    ) -> Dict[str, Any]:
-        # original_path = path
-        # basename = os.path.basename(original_path)
-        result = self.resolve_path(path)
+        if temp_path is not None:
+            # new files take their mode from the temp file on commit
+            os.chmod(temp_path, stat.S_IMODE(mode))
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        if isinstance(entity, (File, Directory)):
+            file_type = (
+                stat.S_IFDIR if isinstance(entity, Directory) else stat.S_IFREG
+            )
+
+            self.update_entity(
+                key,
+                entity,
+                mode=file_type | stat.S_IMODE(mode),
+                ctime=time(),
+            )
+        elif not key:
+            self.update_root(
+                mode=stat.S_IFDIR | stat.S_IMODE(mode), ctime=time()
+            )
+
+    def chown(self, path: PathLike, uid: int, gid: int) -> None:
+        key = path_key(path)
+        entity = self.resolve_attribute_entity(key)
+
+        # -1 keeps the current value
+        values: Dict[str, Any] = {
+            x: y for x, y in [("uid", uid), ("gid", gid)] if y != -1
+        }
 
-        key_names = [
-            "st_atime",
-            "st_ctime",
-            "st_birthtime",
-            "st_gid",
-            "st_mode",
-            "st_mtime",
-            "st_nlink",
-            "st_size",
-            "st_uid",
-        ]
+        if not values:
+            return
 
-        st = os.lstat(path)
+        with self.handles_lock:
+            for handle in self.file_handles.values():
+                if handle.path == key:
+                    handle.uid = values.get("uid", handle.uid)
+                    handle.gid = values.get("gid", handle.gid)
 
-        attributes = {key: getattr(st, key) for key in key_names}
+        if isinstance(entity, (File, Directory)):
+            self.update_entity(key, entity, ctime=time(), **values)
+        elif not key:
+            self.update_root(ctime=time(), **values)
 
-        if isinstance(result, File):
-            stat_db: Dict[str, Union[int, float]] = {
-                "st_atime": result.atime,
-                "st_birthtime": result.ctime,
-                "st_ctime": result.ctime,
-                "st_mtime": result.mtime,
-                "st_size": result.size,
-            }
+    def getattr(
+        self, path: PathLike, fh: Optional[int] = None
+    ) -> Dict[str, Any]:
+        key = path_key(path)
+        result = self.resolve_path(path)
 
-            attributes = {**attributes, **stat_db}
+        if isinstance(result, (File, Directory)) or not key:
+            # committed entries are described by the database alone
+            return self.get_attributes(
+                result if isinstance(result, (File, Directory)) else None
+            )
+
+        try:
+            st = os.lstat(result)
+        except FileNotFoundError:
+            # staged files are unstaged before their temp file is removed,
+            # look the path up again if it was committed in the meantime
+            if self.staged_files.get(key, self.temp.joinpath(key)) == result:
+                raise
 
-        return attributes
+            return self.getattr(key, fh)
+
+        return stat_attributes(st)
 
     getxattr = None  # type: ignore
 
     def readdir(
         self, path: PathLike, fh: Optional[int] = None
-    ) -> Union[List[str], List[Tuple[str, Dict[str, int], int]]]:
-        result = self.resolve_path(path)
+    ) -> Iterator[Tuple[str, Dict[str, Any], int]]:
+        key = path_key(path)
 
-        dirents: List[str] = [".", ".."]
+        # list released files once they are committed
+        self.commit_pipeline.wait(key, children=True)
 
-        if isinstance(result, Directory):
-            file_instances = (
-                self.session.query(File)
-                .select()
-                .where(Constraint("directory_id", "is", result.id))
-                .execute()
-                .fetch_all()
-            )
+        result = self.resolve_path(path)
+        directory_id = None
 
-            dirents += [x.name for x in file_instances]
+        if isinstance(result, Directory):
+            directory_id = result.id
+        elif isinstance(result, File):
+            raise FuseOSError(errno.ENOTDIR)
+        elif key:
+            raise FuseOSError(errno.ENOENT)
 
-            directory_instances = (
-                self.session.query(Directory)
-                .select()
-                .where(Constraint("directory_id", "is", result.id))
-                .execute()
-                .fetch_all()
-            )
+        yield (
+            ".",
+            self.get_attributes(
+                result if isinstance(result, (File, Directory)) else None
+            ),
+            0,
+        )
+        yield ("..", {}, 0)
 
-            dirents += [x.name for x in directory_instances]
-        else:
-            file_instances = (
-                self.session.query(File)
-                .select()
-                .where(Constraint("directory_id", "is", None))
-                .execute()
-                .fetch_all()
-            )
+        # answer lookups of the listed entries from the listing,
+        # unless the directory is too large to keep in memory
+        listing: Optional[Dict[str, Union[File, Directory]]] = {}
+        generation = self.listing_cache.generation
 
-            dirents += [x.name for x in file_instances]
+        for entity in self.iter_db_entities(directory_id):
+            if listing is not None:
+                listing[entity.name] = entity
 
-            directory_instances = (
-                self.session.query(Directory)
-                .select()
-                .where(Constraint("directory_id", "is", None))
-                .execute()
-                .fetch_all()
-            )
+                if len(listing) > self.listing_size:
+                    listing = None
 
-            dirents += [x.name for x in directory_instances]
+            yield (entity.name, self.get_attributes(entity), 0)
 
-        return dirents
+        if listing is not None:
+            self.listing_cache.put(key, listing, generation)
 
     readlink = None  # type: ignore
     # def readlink(self, path):
@@ -304,29 +1193,98 @@ class Passthrough(LoggingMixIn, Operations):
     # def mknod(self, path, mode, dev):
     #     return os.mknod(self._full_path(path), mode, dev)
 
-    rmdir = None  # type: ignore
-    # def rmdir(self, path):
-    #     full_path = self._full_path(path)
-    #     return os.rmdir(full_path)
+    def rmdir(self, path: PathLike) -> None:
+        key = path_key(path)
+
+        # released files are committed into the directory first, entries
+        # further down belong to subdirectories
+        self.commit_pipeline.wait(key, children=True)
+
+        result = self.resolve_db_entity(key)
+
+        if isinstance(result, File):
+            raise FuseOSError(errno.ENOTDIR)
+
+        if not isinstance(result, Directory):
+            raise FuseOSError(errno.ENOENT)
+
+        with self.handles_lock:
+            if any(x.startswith(f"{key}/") for x in self.staged_files):
+                raise FuseOSError(errno.ENOTEMPTY)
+
+        try:
+            with self.session.transaction():
+                if has_children(self.session, result.id):
+                    raise FuseOSError(errno.ENOTEMPTY)
+
+                self.session.query(Directory).delete().where(
+                    Constraint("id", "=", result.id)
+                ).execute().close()
+
+                self.update_directory(result.directory_id, time(), -1)
+        finally:
+            self.invalidate_path(key, tree=True)
+
+    def remove_tree(self, path: PathLike) -> None:
+        # remove a directory with all entries below it, e.g. for rm -r,
+        # in a few statements instead of one request per entry
+        key = path_key(path)
+
+        if not key:
+            raise FuseOSError(errno.EBUSY)
+
+        self.discard_staged_files(key, tree=True)
+
+        result = self.resolve_db_entity(key)
+
+        if isinstance(result, File):
+            self.unlink(path)
+
+            return
+
+        if not isinstance(result, Directory):
+            raise FuseOSError(errno.ENOENT)
+
+        try:
+            with self.session.transaction():
+                delete_tree(self.session, result.id)
+
+                self.update_directory(result.directory_id, time(), -1)
+        finally:
+            self.invalidate_path(key, tree=True)
 
     # mkdir = None  # type: ignore
     def mkdir(self, path: PathLike, mode: int) -> None:
         directory_name = os.path.basename(path)
-        result = self.resolve_path(os.path.dirname(path))
-        parent_directory_id = None
-
-        if isinstance(result, Directory):
-            parent_directory_id = result.id
-
-        self.session.query(Directory).insert(
-            name=directory_name, directory_id=parent_directory_id
-        ).execute().close()
+        parent_directory_id = self.resolve_parent_directory_id(path)
+        uid, gid = self.get_owner()
+        ctime = time()
+
+        try:
+            with self.session.transaction():
+                self.session.query(Directory).insert(
+                    name=directory_name,
+                    directory_id=parent_directory_id,
+                    mode=stat.S_IFDIR | stat.S_IMODE(mode),
+                    uid=uid,
+                    gid=gid,
+                    nlink=2,
+                    ctime=ctime,
+                    atime=ctime,
+                    mtime=ctime,
+                ).execute().close()
+
+                self.update_directory(parent_directory_id, ctime, 1)
+        except sqlite3.IntegrityError:
+            raise FuseOSError(errno.EEXIST)
+        finally:
+            self.invalidate_path(path_key(path))
 
     def statfs(self, path: PathLike) -> Dict[str, Any]:
         result = self.resolve_path(path)
 
         if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
+            path = self.resolve_blob_path(result)
         elif isinstance(result, Directory):
             path = self.temp
         else:
@@ -351,55 +1309,178 @@ class Passthrough(LoggingMixIn, Operations):
 
         return result
 
-    unlink = None  # type: ignore
-    # def unlink(self, path):
-    #     return os.unlink(self._full_path(path))
+    def unlink(self, path: PathLike) -> None:
+        key = path_key(path)
+
+        discarded = self.discard_staged_files(key)
+
+        result = self.resolve_db_entity(key)
+
+        if isinstance(result, Directory):
+            raise FuseOSError(errno.EISDIR)
+
+        if not isinstance(result, File):
+            if not discarded:
+                raise FuseOSError(errno.ENOENT)
+
+            return
+
+        try:
+            with self.session.transaction():
+                # the blob is reclaimed once it is unreferenced, the file
+                # may have been removed concurrently
+                deleted = self.delete_file(result.id)
+
+                if deleted is None:
+                    if not discarded:
+                        raise FuseOSError(errno.ENOENT)
+
+                    return
+
+                self.update_directory(deleted.directory_id, time())
+        finally:
+            self.invalidate_path(key)
 
     symlink = None  # type: ignore
     # def symlink(self, name, target):
     #     return os.symlink(name, self._full_path(target))
 
     def rename(self, old: PathLike, new: PathLike) -> None:
+        # pending commits still refer to the old paths
+        self.commit_pipeline.wait(path_key(old), tree=True)
+        self.commit_pipeline.wait(path_key(new), tree=True)
+
         new_name = os.path.basename(new)
         parent_directory_id = None
 
-        old_result = self.resolve_db_entity(old)
-        new_parent_result = self.resolve_db_entity(os.path.dirname(new))
+        try:
+            with self.session.transaction():
+                parent_directory_id = self.rename_db_entity(
+                    old, new, new_name
+                )
+        except sqlite3.IntegrityError:
+            # the destination conflicts with an entry of another type
+            raise FuseOSError(errno.EEXIST)
+        finally:
+            self.invalidate_path(path_key(old), tree=True)
+            self.invalidate_path(path_key(new), tree=True)
+
+        # move files that are still being written
+        self.rename_staged_files(
+            path_key(old), path_key(new), parent_directory_id
+        )
+
+    def rename_db_entity(
+        self, old: PathLike, new: PathLike, new_name: str
+    ) -> Optional[int]:
+        # called within a transaction, entries are resolved again since
+        # they may have been committed or removed concurrently, returns
+        # the id of the new parent directory
+        parent_directory_id = None
+
+        old_result = self.load_db_entity(old)
+        new_result = self.load_db_entity(new)
+        new_parent_result = self.load_db_entity(os.path.dirname(new))
 
         if isinstance(new_parent_result, Directory):
             parent_directory_id = new_parent_result.id
 
+        # moving a directory only updates its own row, but it can not be
+        # moved into its own subtree
+        if isinstance(old_result, Directory) and is_within_tree(
+            self.session, parent_directory_id, old_result.id
+        ):
+            raise FuseOSError(errno.EINVAL)
+
+        if isinstance(old_result, File) and isinstance(new_result, Directory):
+            raise FuseOSError(errno.EISDIR)
+
+        if isinstance(old_result, Directory) and isinstance(new_result, File):
+            raise FuseOSError(errno.ENOTDIR)
+
+        if isinstance(old_result, File) and isinstance(new_result, File):
+            if new_result.id != old_result.id:
+                # replace existing file
+                self.delete_file(new_result.id)
+
+        if isinstance(old_result, Directory) and isinstance(
+            new_result, Directory
+        ):
+            if new_result.id != old_result.id:
+                # replace existing directory if it is empty
+                if has_children(self.session, new_result.id):
+                    raise FuseOSError(errno.ENOTEMPTY)
+
+                self.session.query(Directory).delete().where(
+                    Constraint("id", "=", new_result.id)
+                ).execute().close()
+
+                self.update_directory(new_result.directory_id, time(), -1)
+
         if isinstance(old_result, File):
             self.session.query(File).update(
                 name=new_name, directory_id=parent_directory_id
-            ).where(Constraint("id", "is", old_result.id)).execute().close()
+            ).where(
+                Constraint("id", "is", old_result.id)
+            ).execute().close()
         elif isinstance(old_result, Directory):
             self.session.query(Directory).update(
                 name=new_name, directory_id=parent_directory_id
-            ).where(Constraint("id", "is", old_result.id)).execute().close()
+            ).where(
+                Constraint("id", "is", old_result.id)
+            ).execute().close()
+
+        if isinstance(old_result, (File, Directory)):
+            ctime = time()
+            old_parent_id = old_result.directory_id
+
+            # moved directories link to their new parent
+            links = int(
+                isinstance(old_result, Directory)
+                and old_parent_id != parent_directory_id
+            )
+
+            self.update_directory(old_parent_id, ctime, -links)
+
+            if old_parent_id != parent_directory_id:
+                self.update_directory(parent_directory_id, ctime, links)
+
+        return parent_directory_id
 
     link = None  # type: ignore
     # def link(self, target, name):
     #     return os.link(self._full_path(target), self._full_path(name))
 
-    utimens = None  # type: ignore
-    # def utimens(self, path, times=None):
-    #     return os.utime(self._full_path(path), times)
+    def utimens(
+        self, path: PathLike, times: Optional[Tuple[float, float]] = None
+    ) -> None:
+        key = path_key(path)
+        entity = self.resolve_attribute_entity(key)
+        now = time()
+
+        atime, mtime = times or (now, now)
+
+        temp_path = self.staged_files.get(key)
+
+        if temp_path is not None:
+            # files take their times from the temp file on commit
+            os.utime(temp_path, (atime, mtime))
+
+        if isinstance(entity, (File, Directory)):
+            self.update_entity(
+                key, entity, atime=atime, mtime=mtime, ctime=now
+            )
+        elif not key:
+            self.update_root(atime=atime, mtime=mtime, ctime=now)
 
     # File methods
     # ============
 
     def open(self, path: PathLike, flags: int) -> int:
-        original_path = Path(str(path)[1:])
+        key = path_key(path)
         file_name = os.path.basename(path)
-        result = self.resolve_path(path)
-
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        writable = flags & os.O_ACCMODE != os.O_RDONLY
+        fh = next(self.file_handle_ids)
 
         # track lifecycle steps
         if self.insert_file_lifecycle(file_name):
@@ -407,335 +1488,452 @@ class Passthrough(LoggingMixIn, Operations):
                 file_name, "open", path=path, flags=flags
             )
 
-        # try and open file from temp directory
-        if str(path).startswith(str(self.temp)):
-            if flags == 0:
-                # readable temp file
-                fh = os.open(path, flags)
+        while True:
+            if writable:
+                # write on top of the committed file
+                self.commit_pipeline.wait(key)
 
-                self.append_to_file_lifecycle(
-                    file_name,
-                    "open -> opened readable temp file",
-                    path=path,
-                    fh=fh,
-                )
+            staging: Optional[threading.Event] = None
+            reserved = False
 
-                return fh
-            else:
-                # writable temp file
-                fh = os.open(path, flags)
+            # staged files are opened and registered atomically, so a
+            # concurrent release never commits a file that is being opened
+            with self.handles_lock:
+                if writable and self.commit_pipeline.is_pending(key):
+                    # released again in the meantime
+                    continue
 
-                # update fh for file in db
-                if fh not in self.writable_file_handles:
-                    self.writable_file_handles.append(fh)
+                handle: Optional[FileHandle] = None
+                temp_path = self.staged_files.get(key)
+                staging = self.staging.get(key) if writable else None
 
-                self.append_to_file_lifecycle(
-                    file_name,
-                    "open -> opened writable temp file",
-                    path=path,
-                    fh=fh,
-                )
+                if temp_path is not None:
+                    handle = self.open_staged_file(fh, key, temp_path, flags)
+                elif writable and staging is None:
+                    # the path is reserved while its blob is staged
+                    # without holding the lock
+                    staging = threading.Event()
+                    reserved = True
 
-                return fh
+                    self.staging[key] = staging
 
-        # try and open file from blobs diretory
-        file_instance = (
-            self.session.query(File)
-            .select()
-            .where(Constraint("name", "=", file_name))
-            .execute()
-            .fetch_one()
-        )
+                if handle is not None:
+                    self.file_handles[fh] = handle
 
-        if file_instance:
-            if flags == 0:
-                # readable blob file
-                blob_path = self.blobs.joinpath(file_instance.hash)
+                    return fh
 
-                fh = os.open(blob_path, flags)
+            if staging is None:
+                break
 
-                self.append_to_file_lifecycle(
-                    file_name,
-                    "open -> opened readable blob file",
-                    path=blob_path,
-                    fh=fh,
-                    access_ok=os.access(blob_path, flags),
-                )
+            if not reserved:
+                # opened for writing by another handle, open its temp file
+                staging.wait()
 
+                continue
+
+            if self.open_writable_file(fh, key, flags, staging):
                 return fh
-            else:
-                # new writable temp file
-                temp_path = self.temp.joinpath(file_name)
 
-                if not temp_path.parent.is_dir():
-                    os.makedirs(temp_path.parent, exist_ok=True)
+        # committed files are opened for reading without holding the lock,
+        # once more if the file was replaced and its blob removed meanwhile
+        try:
+            handle = self.open_readable_file(fh, key, flags)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
 
-                flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+            handle = self.open_readable_file(fh, key, flags)
 
-                fh = os.open(temp_path, flags)
+        with self.handles_lock:
+            self.file_handles[fh] = handle
 
-                if fh not in self.writable_file_handles:
-                    self.writable_file_handles.append(fh)
+        return fh
 
-                self.append_to_file_lifecycle(
-                    file_name,
-                    "open -> opened writable temp file",
-                    path=temp_path,
-                    fh=fh,
-                    access_ok=os.access(temp_path, flags),
-                )
+    def open_staged_file(
+        self, fh: int, key: str, temp_path: Path, flags: int
+    ) -> FileHandle:
+        # open temp file that is still being written
+        owner: Tuple[Optional[int], Optional[int]] = self.get_owner()
 
-                return fh
-        else:
-            raise FuseOSError(errno.ENOENT)
+        # writes through several handles can not be hashed incrementally
+        for x in self.file_handles.values():
+            if x.backing_path == temp_path:
+                x.hasher = None
 
-    def create(
-        self, path: PathLike, mode: int, fi: Optional[bool] = None
-    ) -> int:
-        file_name = os.path.basename(path)
-        result = self.resolve_path(path)
+                # keep the owner of the file that is being created
+                owner = (x.uid, x.gid)
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        entity = self.resolve_db_entity(key)
 
-        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        copy_up = self.copy_ups.get(temp_path)
 
-        # writable temp path
-        temp_path = self.temp.joinpath(file_name)
+        if copy_up is not None and flags & os.O_TRUNC:
+            # the copied blob data is dropped with the content
+            copy_up.truncate(0)
 
-        if not temp_path.parent.is_dir():
-            os.makedirs(temp_path.parent, exist_ok=True)
+        handle = FileHandle(
+            fh,
+            key,
+            temp_path,
+            flags,
+            entity if isinstance(entity, File) else None,
+            self.resolve_parent_directory_id(key),
+        )
 
-        # track lifecycle steps
-        if self.insert_file_lifecycle(file_name):
-            self.append_to_file_lifecycle(
-                file_name, "create", path=path, temp_path=temp_path, mode=mode
+        handle.fd = os.open(temp_path, flags)
+        handle.uid, handle.gid = owner
+
+        self.append_to_file_lifecycle(
+            handle.file_name,
+            "open -> opened temp file",
+            path=temp_path,
+            fh=fh,
+        )
+
+        return handle
+
+    def open_writable_file(
+        self, fh: int, key: str, flags: int, staging: threading.Event
+    ) -> bool:
+        # called with the path reserved, returns whether the handle was
+        # registered, the path changed while staging otherwise
+        try:
+            handle, copy_up = self.stage_writable_file(fh, key, flags)
+        except BaseException:
+            with self.handles_lock:
+                del self.staging[key]
+
+            staging.set()
+
+            raise
+
+        with self.handles_lock:
+            del self.staging[key]
+
+            # created, replaced or removed while the blob was staged
+            current = self.resolve_db_entity(key)
+            published = (
+                key not in self.staged_files
+                and not self.commit_pipeline.is_pending(key)
+                and isinstance(current, File)
+                and handle.entity is not None
+                and current.id == handle.entity.id
+                and current.hash == handle.entity.hash
             )
 
-        fh = os.open(temp_path, flags, mode)
+            if published:
+                self.staged_files[key] = handle.backing_path
+                self.file_handles[fh] = handle
 
-        if fh not in self.writable_file_handles:
-            self.writable_file_handles.append(fh)
+                if copy_up is not None:
+                    self.copy_ups[handle.backing_path] = copy_up
 
-        return fh
+        staging.set()
 
-    def read(self, path: PathLike, size: int, offset: int, fh: int) -> bytes:
-        file_name = os.path.basename(path)
-        result = self.resolve_path(path)
+        if not published:
+            handle.close()
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
+            if copy_up is not None:
+                copy_up.close()
+
+            os.unlink(handle.backing_path)
+
+        return published
+
+    def stage_writable_file(
+        self, fh: int, key: str, flags: int
+    ) -> Tuple[FileHandle, Optional[CopyUp]]:
+        result = self.resolve_db_entity(key)
+
+        if isinstance(result, Directory):
+            raise FuseOSError(errno.EISDIR)
+
+        if not isinstance(result, File):
+            raise FuseOSError(errno.ENOENT)
+
+        # new writable temp file
+        fd, temp_path = self.open_temp_file(os.O_RDWR | os.O_TRUNC)
+
+        handle = FileHandle(
+            fh, key, temp_path, flags, result, result.directory_id
+        )
+
+        handle.fd = fd
+        copy_up: Optional[CopyUp] = None
+
+        if flags & os.O_TRUNC or not result.size:
+            handle.hasher = self.hasher.create()
         else:
-            path = result
+            try:
+                copy_up = self.stage_blob(result, fd, temp_path)
+            except BaseException:
+                os.close(fd)
+                os.unlink(temp_path)
+
+                raise
 
-        # track lifecycle steps
         self.append_to_file_lifecycle(
-            file_name, "read", path=path, size=size, offset=offset, fh=fh
+            handle.file_name,
+            "open -> opened writable temp file",
+            path=handle.backing_path,
+            fh=fh,
         )
 
-        os.lseek(fh, offset, 0)
+        return handle, copy_up
 
-        return os.read(fh, size)
+    def open_blob_reader(self, hash: str) -> BlobReader:
+        if self.blob_store.exists(hash):
+            return self.blob_store.open_reader(hash, self.mmap_reads)
 
-    def write(self, path: PathLike, data: bytes, offset: int, fh: int) -> int:
-        file_name = os.path.basename(path)
-        result = self.resolve_path(path)
+        chunks = self.load_chunks(hash)
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        if not chunks:
+            raise FuseOSError(errno.ENOENT)
 
-        # track lifecycle steps
-        self.append_to_file_lifecycle(
-            file_name, "write", path=path, offset=offset, fh=fh
+        return ChunkedReader(
+            self.blob_store,
+            [(x.offset, x.size, x.chunk_hash) for x in chunks],
         )
 
-        os.lseek(fh, offset, 0)
+    def stage_blob(
+        self, file_instance: File, fd: int, temp_path: Path
+    ) -> Optional[CopyUp]:
+        # files opened for writing without truncation keep their content,
+        # the blob is cloned into the temp file where the file system
+        # shares extents
+        blob_path = self.blob_store.locate(file_instance.hash)
+
+        if blob_path is not None and self.blob_store.codec is None:
+            source_fd = os.open(blob_path, os.O_RDONLY)
+
+            try:
+                if reflink(source_fd, fd) or copy_range(
+                    source_fd, fd, file_instance.size
+                ):
+                    return None
+            finally:
+                os.close(source_fd)
+
+        # otherwise blocks are copied up when they are first accessed
+        reader = self.open_blob_reader(file_instance.hash)
+
+        try:
+            os.ftruncate(fd, file_instance.size)
+
+            return CopyUp(
+                reader, os.open(temp_path, os.O_RDWR), file_instance.size
+            )
+        except BaseException:
+            reader.close()
+
+            raise
 
-        return os.write(fh, data)
+    def open_readable_file(self, fh: int, key: str, flags: int) -> FileHandle:
+        result = self.resolve_db_entity(key)
 
-    truncate = None  # type: ignore
-    # def truncate(self, path, length, fh=None):
-    #     full_path = self._full_path(path)
-    #     with open(full_path, "r+") as f:
-    #         f.truncate(length)
+        if isinstance(result, Directory):
+            raise FuseOSError(errno.EISDIR)
 
-    def flush(self, path: PathLike, fh: int) -> None:
+        if not isinstance(result, File):
+            raise FuseOSError(errno.ENOENT)
+
+        handle = FileHandle(
+            fh,
+            key,
+            self.blob_store.path(result.hash),
+            flags,
+            result,
+            result.directory_id,
+        )
+
+        # readable blob file
+        handle.reader = self.open_blob_reader(result.hash)
+
+        self.append_to_file_lifecycle(
+            handle.file_name,
+            "open -> opened readable blob file",
+            path=handle.backing_path,
+            fh=fh,
+        )
+
+        return handle
+
+    def create(
+        self, path: PathLike, mode: int, fi: Optional[bool] = None
+    ) -> int:
+        key = path_key(path)
         file_name = os.path.basename(path)
-        result = self.resolve_path(path)
+        directory_id = self.resolve_parent_directory_id(path)
+        result = self.resolve_db_entity(path)
+        fh = next(self.file_handle_ids)
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        if isinstance(result, Directory):
+            raise FuseOSError(errno.EISDIR)
+
+        # writable temp path
+        fd, temp_path = self.open_temp_file(os.O_WRONLY | os.O_TRUNC, mode)
 
         # track lifecycle steps
-        self.append_to_file_lifecycle(file_name, "flush", path=path, fh=fh)
+        if self.insert_file_lifecycle(file_name):
+            self.append_to_file_lifecycle(
+                file_name, "create", path=path, temp_path=temp_path, mode=mode
+            )
 
-        return os.fsync(fh)
+        handle = FileHandle(
+            fh,
+            key,
+            temp_path,
+            os.O_WRONLY,
+            result,
+            directory_id,
+        )
 
-    def fsync(self, path: PathLike, datasync: int, fh: int) -> None:
-        file_name = os.path.basename(path)
-        result = self.resolve_path(path)
+        handle.fd = fd
+        handle.hasher = self.hasher.create()
+        handle.uid, handle.gid = self.get_owner()
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        with self.handles_lock:
+            self.staged_files[key] = temp_path
+            self.file_handles[fh] = handle
+
+        return fh
+
+    def read(self, path: PathLike, size: int, offset: int, fh: int) -> bytes:
+        handle = self.get_file_handle(fh)
 
         # track lifecycle steps
         self.append_to_file_lifecycle(
-            file_name, "fsync", path=path, datasync=datasync, fh=fh
+            handle.file_name,
+            "read",
+            path=handle.backing_path,
+            size=size,
+            offset=offset,
+            fh=fh,
         )
 
-        return os.fsync(fh)
+        if handle.reader is not None:
+            return handle.reader.read(size, offset)
 
-    def release(self, path: PathLike, fh: int) -> None:
-        original_path = Path(str(path)[1:])
-        file_name = os.path.basename(path)
-        result = self.resolve_path(path)
+        copy_up = self.copy_ups.get(handle.backing_path)
 
-        if isinstance(result, File):
-            path = self.blobs.joinpath(result.hash)
-        elif isinstance(result, Directory):
-            path = self.temp
-        else:
-            path = result
+        if copy_up is not None:
+            copy_up.fill(offset, size)
+
+        return os.pread(handle.get_fd(), size, offset)
+
+    def write(self, path: PathLike, data: bytes, offset: int, fh: int) -> int:
+        handle = self.get_file_handle(fh)
 
         # track lifecycle steps
-        self.append_to_file_lifecycle(file_name, "release", path=path, fh=fh)
+        self.append_to_file_lifecycle(
+            handle.file_name,
+            "write",
+            path=handle.backing_path,
+            offset=offset,
+            fh=fh,
+        )
 
-        os.close(fh)
+        copy_up = self.copy_ups.get(handle.backing_path)
 
-        # print(json.dumps(self.file_lifecycles, indent=2))
+        if copy_up is not None:
+            # blocks are written on top of the copied blob data
+            copy_up.fill(offset, len(data))
 
-        if fh in self.writable_file_handles:
-            # remove file handle from list of writable file handles
-            self.writable_file_handles.remove(fh)
+        # writes through the same handle are hashed in order
+        with handle.lock:
+            written = os.pwrite(handle.get_fd(), data, offset)
 
-            # create hash from file
-            hash = hash_from_file(path)
+            handle.update_hash(data[:written], offset)
 
-            self.append_to_file_lifecycle(
-                file_name,
-                "release -> created hash",
-                hash=hash,
-                not_empty=hash != self.empty_hash,
-            )
+        return written
 
-            if hash != self.empty_hash:
-                ctime = time()
+    def truncate(
+        self, path: PathLike, length: int, fh: Optional[int] = None
+    ) -> None:
+        if fh is not None:
+            self.truncate_handle(self.get_file_handle(fh), length)
 
-                size = Path(path).stat().st_size
+            return
 
-                file_instance = (
-                    self.session.query(File)
-                    .select()
-                    .where(Constraint("name", "=", file_name))
-                    .execute()
-                    .fetch_one()
-                )
+        # truncate through a temporary handle, which stages and commits
+        # the file, files truncated to zero are not copied first
+        flags = os.O_WRONLY | (os.O_TRUNC if not length else 0)
+        fh = self.open(path, flags)
 
-                if file_instance:
-                    # udpate existing file
-                    previous_hash = file_instance.hash
+        try:
+            self.truncate_handle(self.get_file_handle(fh), length)
+        finally:
+            self.release(path, fh)
 
-                    self.session.query(File).update(
-                        hash=hash, atime=ctime, mtime=ctime, size=size
-                    ).where(
-                        Constraint("id", "=", file_instance.id)
-                    ).execute().close()
+    def truncate_handle(self, handle: FileHandle, length: int) -> None:
+        copy_up = self.copy_ups.get(handle.backing_path)
 
-                    self.append_to_file_lifecycle(
-                        file_name,
-                        "release -> updated file",
-                        updated_file_name=file_instance.name,
-                    )
+        with handle.lock:
+            if copy_up is not None:
+                copy_up.truncate(length)
 
-                    # remove pointless blobs
-                    pointers = (
-                        self.session.query(File)
-                        .select("id")
-                        .where(Constraint("hash", "=", previous_hash))
-                        .execute()
-                        .fetch_all()
-                    )
+            os.ftruncate(handle.get_fd(), length)
 
-                    if not pointers:
-                        previous_blob_path = self.blobs.joinpath(previous_hash)
+            if length != handle.hashed_offset:
+                handle.hasher = None
 
-                        if previous_blob_path.is_file():
-                            os.unlink(previous_blob_path)
-                else:
-                    directory_id = None
-                    parent_directory_instance = self.resolve_db_entity(
-                        original_path.parent
-                    )
+    def flush(self, path: PathLike, fh: int) -> None:
+        handle = self.get_file_handle(fh)
 
-                    if parent_directory_instance:
-                        directory_id = parent_directory_instance.id
+        # track lifecycle steps
+        self.append_to_file_lifecycle(
+            handle.file_name, "flush", path=handle.backing_path, fh=fh
+        )
 
-                    # insert new file
-                    self.session.query(File).insert(
-                        name=file_name,
-                        hash=hash,
-                        ctime=ctime,
-                        atime=ctime,
-                        mtime=ctime,
-                        size=size,
-                        directory_id=directory_id,
-                    ).execute().close()
+        if handle.fd is not None:
+            os.fsync(handle.fd)
 
-                    self.append_to_file_lifecycle(
-                        file_name,
-                        "release -> inserted file",
-                        new_file_name=file_name,
-                    )
+    def fsync(self, path: PathLike, datasync: int, fh: int) -> None:
+        handle = self.get_file_handle(fh)
 
-                # move temp file to blobs if not exist
-                blob_path = self.blobs.joinpath(hash)
-
-                if not blob_path.is_file():
-                    # move temp file to blobs
-                    # if no blob exists for that hash
-                    os.rename(path, blob_path)
-                    # os.chmod(blob_path, 0o777)
-                    # copyfile(path, blob_path)
-
-                    self.append_to_file_lifecycle(
-                        file_name,
-                        "release -> moved blob file",
-                        path=path,
-                        blob_path=blob_path,
-                    )
-                else:
-                    # unlink temp file
-                    # if a blob exists for that hash
-                    os.unlink(path)
+        # track lifecycle steps
+        self.append_to_file_lifecycle(
+            handle.file_name,
+            "fsync",
+            path=handle.backing_path,
+            datasync=datasync,
+            fh=fh,
+        )
 
-                    self.append_to_file_lifecycle(
-                        file_name, "release -> unlinked file", path=path
-                    )
+        if handle.fd is not None:
+            os.fsync(handle.fd)
+
+    def release(self, path: PathLike, fh: int) -> None:
+        handle = self.get_file_handle(fh)
+        file_name = handle.file_name
+
+        # track lifecycle steps
+        self.append_to_file_lifecycle(
+            file_name, "release", path=handle.backing_path, fh=fh
+        )
+
+        handle.close()
+
+        commit: Optional[Future[None]] = None
+
+        with self.handles_lock:
+            self.file_handles.pop(fh, None)
 
-        if file_name in self.file_lifecycles:
-            lifecycle_steps = self.file_lifecycles.setdefault(file_name, [])
+            if handle.writable:
+                # commit once the last writable handle on the temp file is
+                # closed, registered as pending before the lock is released
+                sharing_handles = [
+                    x
+                    for x in self.file_handles.values()
+                    if x.writable and x.backing_path == handle.backing_path
+                ]
 
-            print("=" * 80)
-            print(f"lifecycle complete for: {file_name}")
-            print("=" * 80)
-            print("\n".join(lifecycle_steps))
+                if not sharing_handles:
+                    commit = self.commit_pipeline.submit(handle)
 
-            del self.file_lifecycles[file_name]
+        try:
+            # inline commits run without holding the lock
+            if commit is not None:
+                self.commit_pipeline.run_inline(handle, commit)
+        finally:
+            self.complete_file_lifecycle(file_name)
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+from contextlib import closing
+from time import time
+from typing import Dict, Iterable, List, Set
+from queryfs.blobs import BlobStore
+from queryfs.db.session import Session
+
+logger = logging.getLogger("reclaim")
+
+# add references to a blob, the row is created with the first reference
+REFERENCE_QUERY = " ".join(
+    [
+        "INSERT INTO blobs (hash, size, refcount, ctime) VALUES (?, ?, ?, ?)",
+        "ON CONFLICT (hash) DO UPDATE SET",
+        "refcount = refcount + excluded.refcount",
+    ]
+)
+
+# count references of files and chunks of repositories created before
+# blobs were recorded
+BACKFILL_QUERY = " ".join(
+    [
+        "INSERT INTO blobs (hash, size, refcount, ctime)",
+        "SELECT hash, max(size), count(*), ? FROM (",
+        "SELECT hash, size FROM files",
+        "UNION ALL",
+        "SELECT chunk_hash, size FROM chunks",
+        ") GROUP BY hash",
+    ]
+)
+
+
+class BlobReclaimer:
+    def __init__(
+        self,
+        session: Session,
+        blob_store: BlobStore,
+        interval: float = 1.0,
+        batch_size: int = 1000,
+    ) -> None:
+        self.session = session
+        self.blob_store = blob_store
+
+        # seconds between sweeps and blobs reclaimed per transaction
+        self.interval = interval
+        self.batch_size = batch_size
+
+        # hashes of blobs that are being stored but not referenced yet
+        self.pinned: Dict[str, int] = {}
+        self.pinned_lock = threading.Lock()
+
+        self.stopped = threading.Event()
+
+        # a single sweeper reclaims blobs without references
+        self.thread = threading.Thread(
+            target=self.run, name="blob-reclaimer", daemon=True
+        )
+        self.thread.start()
+
+    def backfill(self) -> None:
+        with self.session.transaction():
+            self.session.connect().execute(BACKFILL_QUERY, [time()]).close()
+
+    def reference(self, hash: str, size: int, count: int = 1) -> None:
+        # called within the transaction that adds the references
+        self.session.connect().execute(
+            REFERENCE_QUERY, [hash, size, count, time()]
+        ).close()
+
+    def dereference(self, hash: str, count: int = 1) -> None:
+        # called within the transaction that removes the references,
+        # blobs are reclaimed by the sweeper once no references are left
+        self.session.connect().execute(
+            "UPDATE blobs SET refcount = max(refcount - ?, 0) WHERE hash = ?",
+            [count, hash],
+        ).close()
+
+    def pin(self, hash: str) -> None:
+        # blobs that already exist are reused by the commit that is storing
+        # them, they must not be reclaimed until it references them
+        with self.pinned_lock:
+            self.pinned[hash] = self.pinned.get(hash, 0) + 1
+
+    def unpin(self, hashes: Iterable[str]) -> None:
+        with self.pinned_lock:
+            for hash in hashes:
+                self.pinned[hash] -= 1
+
+                if not self.pinned[hash]:
+                    del self.pinned[hash]
+
+    def sweep(self) -> int:
+        reclaimed = 0
+
+        while True:
+            count = self.sweep_batch()
+
+            if not count:
+                break
+
+            reclaimed += count
+
+        return reclaimed
+
+    def sweep_batch(self) -> int:
+        with closing(self.session.connect().cursor()) as cursor:
+            hashes: List[str] = [
+                x
+                for (x,) in cursor.execute(
+                    "SELECT hash FROM blobs WHERE refcount <= 0 LIMIT ?",
+                    [self.batch_size],
+                ).fetchall()
+            ]
+
+        if not hashes:
+            return 0
+
+        # pins are not taken while a batch is reclaimed
+        with self.pinned_lock:
+            hashes = [x for x in hashes if x not in self.pinned]
+            reclaimed: Set[str] = set()
+
+            with self.session.transaction():
+                cursor = self.session.connect().cursor()
+
+                for hash in hashes:
+                    # references may have been added in the meantime
+                    cursor.execute(
+                        "DELETE FROM blobs WHERE hash = ? AND refcount <= 0",
+                        [hash],
+                    )
+
+                    if not cursor.rowcount:
+                        continue
+
+                    reclaimed.add(hash)
+
+                    # chunked blobs reference their chunks, which are
+                    # reclaimed by the next batch
+                    chunk_hashes = cursor.execute(
+                        "SELECT chunk_hash FROM chunks WHERE hash = ?", [hash]
+                    ).fetchall()
+
+                    cursor.execute("DELETE FROM chunks WHERE hash = ?", [hash])
+
+                    for (chunk_hash,) in chunk_hashes:
+                        self.dereference(chunk_hash)
+
+                cursor.close()
+
+            # blob files are removed once the rows are gone
+            for hash in reclaimed:
+                self.blob_store.remove(hash)
+
+        logger.info(f"reclaimed {len(reclaimed)} blobs")
+
+        # pinned blobs are retried by the next sweep
+        return len(reclaimed)
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("blob reclamation failed")
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+        self.sweep()
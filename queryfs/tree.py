@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import logging
+
+from contextlib import closing
+from typing import Optional, Tuple
+from queryfs.db.session import Session
+
+logger = logging.getLogger("tree")
+
+# ids of a directory and all directories below it, kept in a temporary
+# table of the connection so the following statements can join it
+SUBTREE_QUERY = " ".join(
+    [
+        "WITH RECURSIVE tree(id) AS (",
+        "SELECT ?",
+        "UNION ALL",
+        "SELECT directories.id FROM directories",
+        "JOIN tree ON directories.directory_id = tree.id",
+        ")",
+        "INSERT INTO subtree (id) SELECT id FROM tree",
+    ]
+)
+
+# remove the references of all files of the subtree from their blobs
+DEREFERENCE_QUERY = " ".join(
+    [
+        "UPDATE blobs SET refcount = max(refcount - counts.amount, 0) FROM (",
+        "SELECT hash, count(*) AS amount FROM files",
+        "WHERE directory_id IN (SELECT id FROM subtree) GROUP BY hash",
+        ") AS counts WHERE blobs.hash = counts.hash",
+    ]
+)
+
+# whether a directory lies within the subtree of another directory
+ANCESTOR_QUERY = " ".join(
+    [
+        "WITH RECURSIVE ancestors(id) AS (",
+        "SELECT ?",
+        "UNION",
+        "SELECT directories.directory_id FROM directories",
+        "JOIN ancestors ON directories.id = ancestors.id",
+        "WHERE directories.directory_id IS NOT NULL",
+        ")",
+        "SELECT 1 FROM ancestors WHERE id = ? LIMIT 1",
+    ]
+)
+
+CHILDREN_QUERY = " ".join(
+    [
+        "SELECT 1 FROM directories WHERE directory_id IS ?",
+        "UNION ALL",
+        "SELECT 1 FROM files WHERE directory_id IS ?",
+        "LIMIT 1",
+    ]
+)
+
+
+def select_subtree(session: Session, directory_id: int) -> int:
+    with closing(session.connect().cursor()) as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS subtree (id INTEGER PRIMARY KEY)"
+        )
+        cursor.execute("DELETE FROM subtree")
+        cursor.execute(SUBTREE_QUERY, [directory_id])
+
+        return cursor.rowcount
+
+
+def delete_tree(session: Session, directory_id: int) -> Tuple[int, int]:
+    # called within a transaction, removes a directory with all entries
+    # below it in a few statements regardless of the number of entries,
+    # unreferenced blobs are left to the reclaimer
+    directories = select_subtree(session, directory_id)
+
+    with closing(session.connect().cursor()) as cursor:
+        cursor.execute(DEREFERENCE_QUERY)
+        cursor.execute(
+            "DELETE FROM files WHERE directory_id IN (SELECT id FROM subtree)"
+        )
+
+        files = cursor.rowcount
+
+        cursor.execute(
+            "DELETE FROM directories WHERE id IN (SELECT id FROM subtree)"
+        )
+        cursor.execute("DELETE FROM subtree")
+
+    logger.info(f"deleted {directories} directories and {files} files")
+
+    return directories, files
+
+
+def has_children(session: Session, directory_id: Optional[int]) -> bool:
+    with closing(session.connect().cursor()) as cursor:
+        row = cursor.execute(
+            CHILDREN_QUERY, [directory_id, directory_id]
+        ).fetchone()
+
+    return row is not None
+
+
+def is_within_tree(
+    session: Session, directory_id: Optional[int], tree_id: int
+) -> bool:
+    # the root directory is not within any subtree
+    if directory_id is None:
+        return False
+
+    with closing(session.connect().cursor()) as cursor:
+        row = cursor.execute(
+            ANCESTOR_QUERY, [directory_id, tree_id]
+        ).fetchone()
+
+    return row is not None
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import random
+
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from queryfs import chunking
+from queryfs.blobs import BlobStore, ChunkedReader
+from queryfs.chunking import Chunker
+from queryfs.compression import get_codec
+
+CHUNK_SIZE = 4096
+
+
+def make_data(size: int) -> bytes:
+    rng = random.Random(size)
+
+    return rng.randbytes(size)
+
+
+def write_chunks(
+    store: BlobStore, chunker: Chunker, data: bytes
+) -> List[Tuple[int, int, str]]:
+    chunks: List[Tuple[int, int, str]] = []
+    offset = 0
+
+    for chunk in chunker.chunks(io.BytesIO(data)):
+        hash = hashlib.sha256(chunk).hexdigest()
+
+        if not store.exists(hash):
+            store.write(hash, chunk)
+
+        chunks.append((offset, len(chunk), hash))
+
+        offset += len(chunk)
+
+    return chunks
+
+
+@pytest.fixture(params=[None, "zlib"], ids=["plain", "zlib"])
+def store(request: pytest.FixtureRequest, tmp_path: Path) -> BlobStore:
+    codec = None if request.param is None else get_codec(request.param)
+
+    return BlobStore(tmp_path, codec, 1024)
+
+
+@pytest.mark.parametrize("vectorised", [True, False])
+def test_chunk_lengths(vectorised: bool) -> None:
+    chunker = Chunker(CHUNK_SIZE)
+    chunker.vectorised = vectorised and chunking.numpy is not None
+
+    data = make_data(CHUNK_SIZE * 50)
+    lengths = [len(x) for x in chunker.chunks(io.BytesIO(data))]
+
+    assert sum(lengths) == len(data)
+    assert all(x <= chunker.maximum_size for x in lengths)
+    assert all(x >= chunker.minimum_size for x in lengths[:-1])
+
+
+def test_vectorised_boundaries() -> None:
+    if chunking.numpy is None:
+        pytest.skip("numpy is not available")
+
+    data = make_data(CHUNK_SIZE * 100)
+
+    for minimum_size in [None, 16, 1]:
+        chunker = Chunker(CHUNK_SIZE, minimum_size)
+        chunker.vectorised = True
+
+        vectorised = chunker.cut_all(data, True)
+
+        chunker.vectorised = False
+
+        assert vectorised == chunker.cut_all(data, True)
+
+
+def test_boundaries_follow_content() -> None:
+    chunker = Chunker(CHUNK_SIZE)
+    data = make_data(CHUNK_SIZE * 50)
+
+    # an insertion only changes the chunks around it
+    before = set(chunker.chunks(io.BytesIO(data)))
+    after = set(
+        chunker.chunks(io.BytesIO(data[:1000] + b"inserted" + data[1000:]))
+    )
+
+    assert len(before - after) <= 2
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK_SIZE * 40 + 7])
+def test_reassembly(store: BlobStore, size: int) -> None:
+    data = make_data(size)
+    chunks = write_chunks(store, Chunker(CHUNK_SIZE), data)
+    reader = ChunkedReader(store, chunks)
+
+    try:
+        assert reader.read(size + 10, 0) == data
+    finally:
+        reader.close()
+
+
+@pytest.mark.parametrize("max_readers", [1, 8])
+def test_random_reads(store: BlobStore, max_readers: int) -> None:
+    data = make_data(CHUNK_SIZE * 40)
+    chunks = write_chunks(store, Chunker(CHUNK_SIZE), data)
+    reader = ChunkedReader(store, chunks, max_readers)
+    rng = random.Random(0)
+
+    try:
+        for _ in range(200):
+            offset = rng.randrange(len(data) + 100)
+            size = rng.randrange(CHUNK_SIZE * 6)
+
+            assert reader.read(size, offset) == data[offset : offset + size]
+
+        # readers of chunks are evicted, not kept open for every chunk
+        assert len(reader.readers) <= max_readers
+    finally:
+        reader.close()
+
+
+def test_reads_across_chunks(store: BlobStore) -> None:
+    data = make_data(CHUNK_SIZE * 20)
+    chunks = write_chunks(store, Chunker(CHUNK_SIZE), data)
+    reader = ChunkedReader(store, chunks)
+
+    try:
+        for offset, _, _ in chunks[1:]:
+            assert reader.read(2, offset - 1) == data[offset - 1 : offset + 1]
+    finally:
+        reader.close()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import os
+import random
+
+from pathlib import Path
+
+import pytest
+
+from queryfs.blobs import BlobStore, FramedReader
+from queryfs.compression import MAGIC, CompressionError, get_codec
+
+FRAME_SIZE = 4096
+
+
+def make_data(size: int) -> bytes:
+    # compressible runs mixed with incompressible ones, so frames are
+    # stored both compressed and as they are
+    rng = random.Random(size)
+    parts = [
+        bytes([rng.randrange(256)]) * 1000 if x % 2 else rng.randbytes(1500)
+        for x in range(size // 1250 + 1)
+    ]
+
+    return b"".join(parts)[:size]
+
+
+def open_reader(path: Path) -> FramedReader:
+    return FramedReader(os.open(path, os.O_RDONLY))
+
+
+@pytest.fixture(params=["zlib", "lzma"])
+def store(request: pytest.FixtureRequest, tmp_path: Path) -> BlobStore:
+    return BlobStore(tmp_path, get_codec(request.param), FRAME_SIZE)
+
+
+@pytest.mark.parametrize("size", [0, 1, FRAME_SIZE, FRAME_SIZE * 5 + 123])
+def test_round_trip(store: BlobStore, size: int) -> None:
+    data = make_data(size)
+
+    store.write("blob", data)
+
+    reader = store.open_reader("blob")
+
+    try:
+        assert isinstance(reader, FramedReader)
+        assert reader.size == size
+        assert reader.read(size + 10, 0) == data
+    finally:
+        reader.close()
+
+
+def test_put_matches_write(store: BlobStore, tmp_path: Path) -> None:
+    data = make_data(FRAME_SIZE * 3 + 17)
+    source = tmp_path.joinpath("source")
+    source.write_bytes(data)
+
+    store.put("blob", source)
+
+    reader = store.open_reader("blob")
+
+    try:
+        assert reader.read(len(data), 0) == data
+    finally:
+        reader.close()
+
+
+def test_random_reads(store: BlobStore) -> None:
+    data = make_data(FRAME_SIZE * 8 + 999)
+    rng = random.Random(0)
+
+    store.write("blob", data)
+
+    reader = store.open_reader("blob")
+
+    try:
+        for _ in range(200):
+            offset = rng.randrange(len(data) + 100)
+            size = rng.randrange(FRAME_SIZE * 3)
+
+            assert reader.read(size, offset) == data[offset : offset + size]
+    finally:
+        reader.close()
+
+
+def test_reads_across_frames(store: BlobStore) -> None:
+    data = make_data(FRAME_SIZE * 4)
+
+    store.write("blob", data)
+
+    reader = store.open_reader("blob")
+
+    try:
+        for boundary in range(FRAME_SIZE, len(data), FRAME_SIZE):
+            for before, after in [(1, 1), (10, FRAME_SIZE), (0, 1)]:
+                offset = boundary - before
+                size = before + after
+
+                assert reader.read(size, offset) == (
+                    data[offset : offset + size]
+                )
+    finally:
+        reader.close()
+
+
+def test_truncated_file(store: BlobStore) -> None:
+    data = make_data(FRAME_SIZE * 3)
+
+    store.write("blob", data)
+
+    blob_path = store.path("blob")
+    framed = blob_path.read_bytes()
+
+    for size in [len(framed) - 1, len(framed) // 2, 10, 0]:
+        blob_path.write_bytes(framed[:size])
+
+        with pytest.raises(CompressionError):
+            open_reader(blob_path)
+
+
+def test_not_framed_file(tmp_path: Path) -> None:
+    blob_path = tmp_path.joinpath("blob")
+
+    for data in [b"plain", make_data(FRAME_SIZE)]:
+        blob_path.write_bytes(data)
+
+        with pytest.raises(CompressionError):
+            open_reader(blob_path)
+
+
+def test_unknown_codec() -> None:
+    with pytest.raises(CompressionError):
+        get_codec("unknown")
+
+
+def test_incompressible_frames_are_stored(store: BlobStore) -> None:
+    data = os.urandom(FRAME_SIZE * 2)
+
+    store.write("blob", data)
+
+    reader = store.open_reader("blob")
+
+    try:
+        assert isinstance(reader, FramedReader)
+        assert all(x[1] for x in reader.index.entries)
+        assert reader.read(len(data), 0) == data
+    finally:
+        reader.close()
+
+    assert store.path("blob").read_bytes()[:4] == MAGIC
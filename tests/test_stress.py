@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import builtins
+import errno
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, List
+
+import pytest
+
+try:
+    # fusepy loads libfuse on import
+    from queryfs.passthrough import Passthrough
+except (ImportError, OSError):
+    pytest.skip("fusepy or libfuse is not available", allow_module_level=True)
+
+THREADS = 16
+ITERATIONS = 25
+
+
+@pytest.fixture(params=[4, 0], ids=["background", "inline"])
+def operations(
+    request: Any, tmp_path: Path, monkeypatch: Any
+) -> Iterator[Passthrough]:
+    # file lifecycles are printed
+    monkeypatch.setattr(builtins, "print", lambda *args, **kwargs: None)
+
+    operations = Passthrough(
+        tmp_path.joinpath("repository"),
+        commit_workers=request.param,
+        reclaim_interval=0.01,
+    )
+
+    yield operations
+
+    operations.destroy("/")
+
+
+def write_file(operations: Passthrough, path: str, data: bytes) -> None:
+    fh = operations.create(path, 0o644)
+
+    try:
+        operations.write(path, data, 0, fh)
+    finally:
+        operations.release(path, fh)
+
+
+def read_file(operations: Passthrough, path: str) -> bytes:
+    fh = operations.open(path, os.O_RDONLY)
+
+    try:
+        size = operations.getattr(path, fh)["st_size"]
+
+        return operations.read(path, size, 0, fh)
+    finally:
+        operations.release(path, fh)
+
+
+def list_names(operations: Passthrough, path: str) -> List[str]:
+    return [x for x, _, _ in operations.readdir(path) if x not in (".", "..")]
+
+
+def run_threads(target: Any) -> None:
+    barrier = threading.Barrier(THREADS)
+
+    def run(index: int) -> None:
+        barrier.wait()
+
+        target(index)
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        for future in [executor.submit(run, x) for x in range(THREADS)]:
+            future.result()
+
+
+def check_references(operations: Passthrough) -> None:
+    connection = operations.session.connect()
+
+    assert not connection.execute(
+        "SELECT hash FROM blobs WHERE refcount < 0"
+    ).fetchall()
+
+    # every file keeps its blob referenced
+    assert not connection.execute(
+        " ".join(
+            [
+                "SELECT files.hash FROM files",
+                "LEFT JOIN blobs ON blobs.hash = files.hash",
+                "GROUP BY files.hash",
+                "HAVING count(*) > ifnull(max(blobs.refcount), 0)",
+            ]
+        )
+    ).fetchall()
+
+
+def test_concurrent_writes(operations: Passthrough) -> None:
+    def work(index: int) -> None:
+        directory = f"/d{index}"
+
+        operations.mkdir(directory, 0o755)
+
+        for x in range(ITERATIONS):
+            path = f"{directory}/f{x}"
+            data = f"{index}-{x}".encode() * (x + 1)
+
+            write_file(operations, path, data)
+
+            assert read_file(operations, path) == data
+
+            operations.rename(path, f"{directory}/g{x}")
+
+            if x % 2:
+                operations.unlink(f"{directory}/g{x}")
+
+    run_threads(work)
+
+    operations.drain()
+
+    for index in range(THREADS):
+        names = list_names(operations, f"/d{index}")
+
+        assert sorted(names) == sorted(
+            [f"g{x}" for x in range(0, ITERATIONS, 2)]
+        )
+
+        for x in range(0, ITERATIONS, 2):
+            assert read_file(operations, f"/d{index}/g{x}") == (
+                f"{index}-{x}".encode() * (x + 1)
+            )
+
+    check_references(operations)
+
+
+def test_concurrent_reads(operations: Passthrough) -> None:
+    data = os.urandom(1 << 20)
+
+    write_file(operations, "/shared", data)
+
+    operations.drain()
+
+    def work(index: int) -> None:
+        for _ in range(ITERATIONS):
+            assert read_file(operations, "/shared") == data
+
+    run_threads(work)
+
+
+def test_racing_replacements(operations: Passthrough) -> None:
+    # threads replace and remove the same files
+    def work(index: int) -> None:
+        for x in range(ITERATIONS):
+            source = f"/source{index}"
+
+            write_file(operations, source, f"{index}-{x}".encode())
+
+            operations.drain()
+
+            try:
+                operations.rename(source, f"/target{x % 3}")
+            except OSError as e:
+                assert e.errno == errno.ENOENT
+
+            try:
+                operations.unlink(f"/target{(x + index) % 3}")
+            except OSError as e:
+                assert e.errno == errno.ENOENT
+
+    run_threads(work)
+
+    operations.drain()
+
+    check_references(operations)
+
+    # files left behind are readable
+    for name in list_names(operations, "/"):
+        read_file(operations, f"/{name}")
@@ -3,7 +3,7 @@ This type stub file was generated by pyright.
 """
 
 import ctypes
-from typing import Any, AnyStr, Dict, List, Optional, Tuple, Union
+from typing import Any, AnyStr, Dict, Iterable, List, Optional, Tuple, Union
 from __future__ import absolute_import, division, print_function
 
 log: str = ...
@@ -153,7 +153,7 @@ class Operations(object):
         ...
     def readdir(
         self, path: str, fh: int
-    ) -> Union[List[str], List[Tuple[str, Dict[str, int], int]]]:
+    ) -> Union[Iterable[str], Iterable[Tuple[str, Dict[str, Any], int]]]:
         """
         Can return either a list of names, or a list of (name, attrs, offset)
         tuples. attrs is a dict as in getattr.